@@ -0,0 +1,221 @@
+import threading
+import time
+import numpy as np
+import session
+
+
+class Sequence(list):
+    """
+    A ReplaySource take made of several takes played one after another with gap_seconds of
+    noise between them, like a player going through all the notes of a preset in one go.
+    """
+    def __init__(self, takes, gap_seconds=0.5):
+        super().__init__(takes)
+        self.gap_seconds = gap_seconds
+
+
+class SoundDeviceSource:
+    """
+    Live input from a sound card through sounddevice.
+
+    A source calls callback(block, overflowed) from its own thread for every block of input, where
+    block is a (frames, channels) float32 array.  A source that knows when a take is over (see
+    ReplaySource) also calls take_ended(request) with the number of the note request it has finished
+    playing.  A live input never knows, so it never calls it.
+
+    :param fs: Sample rate.
+    :param channels: Number of input channels.
+    :param blocksize: Frames per callback.
+    :param device: sounddevice device number or name (None for the default input).
+    """
+    realtime = True
+
+    def __init__(self, fs, channels=1, blocksize=128, device=None):
+        self.fs = fs
+        self.channels = channels
+        self.blocksize = blocksize
+        self.device = device
+        self.stream = None
+
+    def describe(self):
+        import sounddevice as sd
+
+        return str(sd.query_devices())
+
+    def name(self):
+        """Name of the input device, used to key calibration profiles."""
+        import sounddevice as sd
+
+        return sd.query_devices(self.device, 'input')['name']
+
+    def start(self, callback, take_ended=None):
+        import sounddevice as sd
+
+        def sd_callback(indata, frames, time, status):
+            callback(indata, status.input_overflow)
+
+        self.stream = sd.InputStream(channels=self.channels, samplerate=self.fs, blocksize=self.blocksize,
+                                     device=self.device, callback=sd_callback)
+        self.stream.start()
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+    def note_requested(self):
+        pass  # Someone at the keyboard plays the note
+
+    def record(self, seconds):
+        """Blocking capture of `seconds` of input, as a (frames, channels) array."""
+        import sounddevice as sd
+
+        audio = np.zeros((int(seconds * self.fs), self.channels), dtype=np.float32)
+        with sd.InputStream(channels=self.channels, samplerate=self.fs, device=self.device) as stream:
+            for i in range(0, len(audio), 1024):
+                data, _ = stream.read(min(1024, len(audio) - i))
+                audio[i:i + len(data)] = data
+        return audio
+
+
+class ReplaySource:
+    """
+    Stand-in for a sound card that plays back pre-recorded takes (wav files or numpy arrays)
+    through the same callback path, as fast as the CPU allows unless realtime=True.
+
+    Each take is sent when a note is requested (see CaptureEngine.arm), with lead_seconds of
+    background noise before it and gap_seconds after it, so it looks like a key being played.
+    After that (or straight away if the take's file is missing or can't be read) take_ended is called, so a
+    channel where nothing was played doesn't have to wait for a timeout.
+
+    :param takes: List of wav file paths (read as mono with session.read_wav) and/or numpy arrays
+                  (mono, or (frames, channels)).  A take can also be a list with one mono take per
+                  channel, played at the same time, or a Sequence of takes played one after the other.
+    :param fs: Sample rate.
+    :param channels: Number of channels to deliver.
+    :param blocksize: Frames per callback.
+    :param lead_seconds: Noise before each take.
+    :param gap_seconds: Noise after each take, should be longer than the silence that ends a note.
+    :param noise: Standard deviation of the background noise.
+    :param realtime: Pace the blocks like a real sound card.
+    """
+    def __init__(self, takes, fs, channels=1, blocksize=128, lead_seconds=0.2, gap_seconds=3.0,
+                 noise=1e-4, realtime=False, seed=0):
+        self.takes = list(takes)
+        self.fs = fs
+        self.channels = channels
+        self.blocksize = blocksize
+        self.lead_seconds = lead_seconds
+        self.gap_seconds = gap_seconds
+        self.noise = noise
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.requests = threading.Semaphore(0)
+        self.stopping = threading.Event()
+        self.finished = threading.Event()
+        self.thread = None
+
+    def describe(self):
+        return f"Replaying {len(self.takes)} takes at {self.fs}Hz"
+
+    def name(self):
+        return "replay"
+
+    def load(self, take):
+        if isinstance(take, Sequence):
+            return self.load_sequence(take)
+        if isinstance(take, (list, tuple)):
+            return self.load_channels(take)
+        if not isinstance(take, str):
+            audio = np.asarray(take, dtype=np.float32)
+        else:
+            wav = session.read_wav(take)
+            if wav.fs != self.fs:
+                raise ValueError(f"{take} is {wav.fs}Hz, expected {self.fs}Hz")
+            audio = wav.audio
+        if audio.ndim == 1:
+            audio = np.repeat(audio[:, None], self.channels, axis=1)
+        return audio
+
+    def load_sequence(self, sequence):
+        """The takes of a Sequence back to back.  Missing ones are left out (a note that wasn't played)."""
+        pieces = []
+        for take in sequence:
+            try:
+                audio = self.load(take)
+            except FileNotFoundError:
+                print(f"Nothing to replay for {take}")
+                continue
+            if pieces:
+                pieces.append(self.silence(sequence.gap_seconds))
+            pieces.append(audio)
+        if not pieces:
+            raise FileNotFoundError(list(sequence))
+        return np.concatenate(pieces)
+
+    def load_channels(self, takes):
+        """One mono take per channel, padded with noise to the longest.  Missing files are silent."""
+        channels = []
+        for take in takes:
+            if take is None:
+                channels.append(None)  # Nothing plugged in
+                continue
+            try:
+                channels.append(self.load(take)[:, 0])
+            except FileNotFoundError:
+                print(f"Nothing to replay for {take}")
+                channels.append(None)
+        if all(channel is None for channel in channels):
+            raise FileNotFoundError(takes)
+        length = max(len(channel) for channel in channels if channel is not None)
+        audio = self.rng.normal(0, self.noise, (length, len(channels))).astype(np.float32)
+        for i, channel in enumerate(channels):
+            if channel is not None:
+                audio[:len(channel), i] = channel
+        return audio
+
+    def silence(self, seconds):
+        return self.rng.normal(0, self.noise, (int(seconds * self.fs), self.channels)).astype(np.float32)
+
+    def start(self, callback, take_ended=None):
+        self.thread = threading.Thread(target=self.run, args=(callback, take_ended), daemon=True)
+        self.thread.start()
+
+    def run(self, callback, take_ended=None):
+        for request, take in enumerate(self.takes, 1):
+            while not self.requests.acquire(timeout=0.1):
+                if self.stopping.is_set():
+                    return
+            try:
+                audio = self.load(take)
+            except FileNotFoundError:
+                print(f"Nothing to replay for {take}")
+                audio = None  # Same as nobody playing the note
+            except Exception as e:
+                # Keep the replay going, a dead thread would leave every later note waiting for a timeout
+                print(f"Can't replay {take}: {type(e).__name__}: {e}")
+                audio = None
+            if audio is not None:
+                audio = np.concatenate([self.silence(self.lead_seconds), audio, self.silence(self.gap_seconds)])
+                for i in range(0, len(audio), self.blocksize):
+                    if self.stopping.is_set():
+                        return
+                    callback(audio[i:i + self.blocksize], False)
+                    if self.realtime:
+                        time.sleep(self.blocksize / self.fs)
+            if take_ended is not None:
+                take_ended(request)
+        self.finished.set()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def note_requested(self):
+        self.requests.release()
+
+    def record(self, seconds):
+        return self.silence(seconds)
@@ -0,0 +1,143 @@
+import os, glob, sys
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import casioloopdetect
+import loopcache
+import loopdb
+
+METHODS = ["old", "fast", "multires"]  # The --method choices
+
+
+def find_wave_files(synth_dir):
+    """
+    Collect recordings/<synth>/<preset>/*.wav grouped by preset directory.
+
+    :param synth_dir: Directory holding one sub-directory per preset.
+    :return: dict of preset directory -> sorted list of wav paths.
+    """
+    presets = {}
+    for w in sorted(glob.glob(os.path.join(synth_dir, "*", "*.wav"))):
+        presets.setdefault(os.path.dirname(w), []).append(w)
+    return presets
+
+
+def detect_loop(file_path, fraction_of_expected_loop=0.2, metric='l1', pitched=False, method='fast',
+                cache_dir=None):
+    """
+    Worker: load one wav and run find_loop on it.  Results are cached in cache_dir unless it is None.
+
+    :return: (file_path, loop_start, loop_end, score, seconds)
+    """
+    import librosa
+
+    t0 = time.perf_counter()
+    audio, sr = librosa.load(file_path, sr=None)
+    cache = loopcache.LoopCache(cache_dir) if cache_dir is not None else None
+    note = casioloopdetect.note_from_filename(file_path) if pitched else None
+    loop_start, loop_end, score = find_loop(audio, sr, fraction_of_expected_loop, metric, note, method, cache)
+    return file_path, loop_start, loop_end, score, time.perf_counter() - t0
+
+
+def find_loop(audio, sr, fraction_of_expected_loop=0.2, metric='l1', note=None, method='fast', cache=None):
+    """
+    find_seamless_loop with one of the METHODS, or with a note, only loop lengths that are whole
+    periods of it.  'old' only has the l1 metric, so metric isn't passed to it.
+
+    :return: (loop_start, loop_end, score)
+    """
+    if note is not None:
+        return loopcache.find_seamless_loop_pitched(audio, sr, note, fraction_of_expected_loop, metric=metric,
+                                                    cache=cache)
+    kwargs = {} if method == 'old' else {'metric': metric}
+    return loopcache.find_seamless_loop(audio, sr, fraction_of_expected_loop, method=method, cache=cache, **kwargs)
+
+
+def loop_line(file_path, loop_start, loop_end, score):
+    quality = "good" if loop_start is not None and loop_end is not None else "bad"
+    return f"{file_path},{loop_start},{loop_end},{score},{quality}\n"
+
+
+def loop_row(file_path, loop_start, loop_end, score, detector, params):
+    """A loop for loopdb.LoopDB.put_many."""
+    synth, preset, note = loopdb.split_path(file_path)
+    quality = "good" if loop_start is not None and loop_end is not None else "bad"
+    return {'synth': synth, 'preset': preset, 'note': note, 'file_path': file_path, 'loop_start': loop_start,
+            'loop_end': loop_end, 'score': score, 'quality': quality, 'detector': detector, 'params': params}
+
+
+def write_loops_file(preset_dir, results):
+    """
+    Write selected_loops.txt for a preset in one go.  The file is written next to the
+    old one and renamed over it, so readers never see a half written file.
+    """
+    loop_file_path = os.path.join(preset_dir, "selected_loops.txt")
+    tmp_path = loop_file_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        for file_path in sorted(results):
+            f.write(loop_line(file_path, *results[file_path]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, loop_file_path)
+    return loop_file_path
+
+
+def detect_synth_loops(synth_dir, fraction_of_expected_loop=0.2, metric='l1', workers=None, pitched=False,
+                       method='fast', cache_dir=loopcache.CACHE_DIR):
+    presets = find_wave_files(synth_dir)
+    wave_files = [w for files in presets.values() for w in files]
+    results = {preset_dir: {} for preset_dir in presets}
+    remaining = {preset_dir: len(files) for preset_dir, files in presets.items()}
+    workers = workers or os.cpu_count()
+
+    detector = 'pitched' if pitched else method
+    params = {'fraction_of_expected_loop': fraction_of_expected_loop, 'metric': metric}
+
+    print(f"Detecting loops in {len(wave_files)} files from {len(presets)} presets using {workers} workers")
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool, loopdb.LoopDB(loopdb.db_path(synth_dir)) as db:
+        futures = {pool.submit(detect_loop, w, fraction_of_expected_loop, metric, pitched, method, cache_dir): w
+                   for w in wave_files}
+        for n, future in enumerate(as_completed(futures), 1):
+            try:
+                file_path, loop_start, loop_end, score, seconds = future.result()
+            except Exception as e:
+                # An unreadable wav gets a bad loop, so the rest of its preset is still written
+                file_path, loop_start, loop_end, score, seconds = futures[future], None, None, None, 0.0
+                print(f"[{n}/{len(wave_files)}] {file_path}: FAILED {type(e).__name__}: {e}")
+            preset_dir = os.path.dirname(file_path)
+            results[preset_dir][file_path] = (loop_start, loop_end, score)
+            print(f"[{n}/{len(wave_files)}] {file_path}: {loop_start} -> {loop_end} score {score} ({seconds:0.2f}s)")
+
+            # Write each preset's loop file as soon as its last sample is done
+            remaining[preset_dir] -= 1
+            if remaining[preset_dir] == 0:
+                print(f"    Wrote {write_loops_file(preset_dir, results[preset_dir])}")
+                db.put_many([loop_row(path, *result, detector, params) for path, result in results[preset_dir].items()])
+
+    print(f"...done in {time.perf_counter() - t0:0.2f} seconds.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect loop points for every recording of a synth.")
+    parser.add_argument("synth_dir", help="e.g. 'recordings/Casio Casiotone MT-70'")
+    parser.add_argument("--fraction", type=float, default=0.2, help="fraction_of_expected_loop (default 0.2)")
+    parser.add_argument("--metric", choices=["l1", "l2"], default="l1",
+                        help="l1 is exact, l2 is faster on long samples")
+    parser.add_argument("--method", choices=METHODS, default="fast",
+                        help="loop detector, multires is the quickest on long samples")
+    parser.add_argument("--pitched", action="store_true",
+                        help="only try loop lengths that are whole periods of the note in the file name")
+    parser.add_argument("--cache-dir", default=loopcache.CACHE_DIR, help="where to cache loop results")
+    parser.add_argument("--no-cache", action="store_true", help="re-detect every file, ignoring the cache")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: all cores)")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.synth_dir):
+        sys.exit(f"No such directory: {args.synth_dir}")
+    detect_synth_loops(args.synth_dir, args.fraction, args.metric, args.workers, args.pitched, args.method,
+                       None if args.no_cache else args.cache_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import json
+import numpy as np
+
+PROFILE_FILE = "calibration_profiles.json"
+
+
+class NoiseStats:
+    """
+    Noise floor statistics collected in one pass over blocks of audio.
+
+    Mean and variance are merged block by block (Chan/Welford), so nothing but a few numbers
+    is kept however long the capture is.  With bands set, the average power in that many
+    log-spaced frequency bands is kept too, as a per-band noise floor.
+
+    :param fs: Sample rate (only needed for the bands).
+    :param bands: Number of frequency bands, or None for no spectral floor.
+    :param fft_size: Samples per FFT frame for the bands.
+    """
+    def __init__(self, fs=None, bands=None, fft_size=2048):
+        self.fs = fs
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.peak = 0.0
+        self.min_abs = np.inf
+        self.sum_abs = 0.0
+        self.bands = bands
+        self.fft_size = fft_size
+        self.frames = 0
+        self.leftover = np.zeros(0, dtype=np.float32)
+        if bands:
+            # Band edges in FFT bins, log spaced from ~20Hz up to Nyquist.  The lowest bands can
+            # be narrower than a bin, those get merged so there may be fewer than asked for.
+            lowest = max(1, int(20 * fft_size / fs))
+            self.band_edges = np.unique(np.geomspace(lowest, fft_size // 2 + 1, bands + 1).astype(int))
+            self.bands = len(self.band_edges) - 1
+        self.band_power = np.zeros(self.bands) if self.bands else None
+
+    def update(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        n = len(block)
+        if n == 0:
+            return
+        levels = np.abs(block)
+        block_mean = block.mean()
+        block_m2 = np.sum((block - block_mean) ** 2)
+        delta = block_mean - self.mean
+        total = self.count + n
+        self.mean += delta * n / total
+        self.m2 += block_m2 + delta ** 2 * self.count * n / total
+        self.count = total
+        self.peak = max(self.peak, float(levels.max()))
+        self.min_abs = min(self.min_abs, float(levels.min()))
+        self.sum_abs += float(levels.sum())
+        if self.bands:
+            self.update_bands(block)
+
+    def update_bands(self, block):
+        audio = np.concatenate([self.leftover, block])
+        n_frames = len(audio) // self.fft_size
+        self.leftover = audio[n_frames * self.fft_size:]
+        if n_frames == 0:
+            return
+        frames = audio[:n_frames * self.fft_size].reshape(n_frames, self.fft_size) * np.hanning(self.fft_size)
+        power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+        cumulative = np.concatenate([np.zeros((n_frames, 1)), np.cumsum(power, axis=1)], axis=1)
+        edges = self.band_edges
+        per_band = (cumulative[:, edges[1:]] - cumulative[:, edges[:-1]]) / (edges[1:] - edges[:-1])
+        self.band_power += per_band.sum(axis=0)
+        self.frames += n_frames
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count else 0.0
+
+    @property
+    def mean_abs(self):
+        return self.sum_abs / self.count if self.count else 0.0
+
+    @property
+    def band_floor_db(self):
+        if not self.frames:
+            return None
+        return (10 * np.log10(self.band_power / self.frames + 1e-30)).tolist()
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std, 'peak': self.peak,
+                'min_abs': self.min_abs, 'mean_abs': self.mean_abs, 'band_floor_db': self.band_floor_db}
+
+
+def noise_stats(audio, fs, bands=None, block_size=4096):
+    """NoiseStats of a mono capture, fed through in blocks."""
+    stats = NoiseStats(fs, bands)
+    for i in range(0, len(audio), block_size):
+        stats.update(audio[i:i + block_size])
+    return stats
+
+
+def measure_noise(source, seconds, bands=None, skip=15, channels=(0,)):
+    """
+    Capture `seconds` of silence from source and return a NoiseStats for each of `channels`.
+
+    :param skip: Samples dropped at the start (I get pops sometimes at the very beginning of recording).
+    """
+    audio = source.record(seconds)[skip:]
+    return [noise_stats(audio[:, channel], source.fs, bands) for channel in channels]
+
+
+def profile_key(source, channel=0):
+    """Device name and sample rate, plus the input channel on multi-input sources."""
+    if source.channels > 1:
+        return f"{source.name()}@{source.fs}#{channel + 1}"
+    return f"{source.name()}@{source.fs}"
+
+
+def load_profiles(path=PROFILE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_profile(key, profile, path=PROFILE_FILE):
+    """Add or replace one profile, writing the file atomically."""
+    profiles = load_profiles(path)
+    profiles[key] = profile
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profiles, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def verify_profile(profile, stats, tolerance=2.0, min_fraction=0.25):
+    """
+    True if a short capture still looks like the noise floor the profile was made with: its
+    peak and standard deviation are no more than `tolerance` times the profile's, and no less
+    than `min_fraction` of them.  A dead or muted input (all zeros) fails, rather than quietly
+    reusing thresholds made for a live one.
+    """
+    noise = profile['noise']
+    return (noise['peak'] * min_fraction <= stats.peak <= noise['peak'] * tolerance
+            and noise['std'] * min_fraction <= stats.std <= noise['std'] * tolerance)
@@ -0,0 +1,316 @@
+import queue
+import time
+from collections import namedtuple
+import numpy as np
+
+
+class NoteBuffer:
+    """
+    Preallocated float32 capture buffer for one note, with a pre-roll ring.
+
+    Before trigger() blocks go into a ring of the last `pre_roll_seconds` of audio, so the attack
+    that happened before the start threshold was crossed isn't lost.  trigger() moves that ring to
+    the front of the buffer and everything after it is written straight behind it, so view() is
+    always one contiguous array with no copies.
+
+    :param fs: Sample rate.
+    :param max_seconds: Longest note to keep (not counting the pre-roll).
+    :param pre_roll_seconds: How much audio from before the trigger to keep.
+    :param skip: Number of samples to throw away at the very start of the stream (pops).
+    """
+    def __init__(self, fs, max_seconds, pre_roll_seconds=0.0, skip=0):
+        self.pre_roll = int(pre_roll_seconds * fs)
+        self.data = np.zeros(self.pre_roll + int(max_seconds * fs), dtype=np.float32)
+        self.skip = skip
+        self.ring_written = 0
+        self.length = 0
+        self.started = False
+
+    @property
+    def full(self):
+        return self.started and self.length == len(self.data)
+
+    def write(self, block):
+        """
+        Add a block of samples.  Returns the number of samples that didn't fit.
+        """
+        if self.skip:
+            dropped = min(self.skip, len(block))
+            block = block[dropped:]
+            self.skip -= dropped
+
+        if not self.started:
+            self.write_ring(block)
+            return 0
+
+        n = min(len(block), len(self.data) - self.length)
+        self.data[self.length:self.length + n] = block[:n]
+        self.length += n
+        return len(block) - n
+
+    def write_ring(self, block):
+        if self.pre_roll == 0:
+            return
+        block = block[-self.pre_roll:]
+        position = self.ring_written % self.pre_roll
+        first = min(len(block), self.pre_roll - position)
+        self.data[position:position + first] = block[:first]
+        self.data[:len(block) - first] = block[first:]
+        self.ring_written += len(block)
+
+    def trigger(self):
+        """
+        Start the note.  The pre-roll collected so far becomes the beginning of the note.
+        """
+        if self.started:
+            return
+        if self.ring_written > self.pre_roll:
+            # The ring has wrapped, put the oldest sample first
+            position = self.ring_written % self.pre_roll
+            self.data[:self.pre_roll] = np.roll(self.data[:self.pre_roll], -position)
+        self.length = min(self.ring_written, self.pre_roll)
+        self.started = True
+
+    def view(self):
+        return self.data[:self.length]
+
+
+CapturedNote = namedtuple('CapturedNote', ['audio', 'onset', 'offset', 'start_sample', 'overflowed'])
+
+
+class CaptureEngine:
+    """
+    Keeps one audio source (see audiosource.py) running for the whole session and cuts notes out
+    of it on the audio thread.
+
+    Each callback block gets a constant amount of work: a peak check against the start or stop
+    threshold and one copy into the note's NoteBuffer.  Finished notes go to the consumer through
+    a bounded queue.  Onset and offset are sample indices into the note's audio: onset is the
+    first sample over start_threshold, offset is one past the last sample over stop_threshold.
+
+    :param source: An audiosource.SoundDeviceSource or ReplaySource.
+    :param start_threshold: A note starts at the first sample louder than this.
+    :param stop_threshold: A note ends after silence_duration seconds below this.
+    :param silence_duration: Seconds of silence that end a note.
+    :param max_record_seconds: Longest note (not counting the pre-roll).
+    :param pre_roll_seconds: Audio kept from before the onset.
+    :param skip: Samples dropped at the start of the stream (pops).
+    :param queue_size: Finished notes waiting for the consumer.
+    :param channel: Which input channel of the source to record.
+    """
+    def __init__(self, source, start_threshold, stop_threshold, silence_duration, max_record_seconds,
+                 pre_roll_seconds=0.0, skip=15, queue_size=4, channel=0):
+        self.source = source
+        self.channel = channel
+        self.fs = fs = source.fs
+        self.start_threshold = start_threshold
+        self.stop_threshold = stop_threshold
+        self.silence_samples = int(silence_duration * fs)
+        self.note_silence_samples = self.silence_samples
+        self.max_record_seconds = max_record_seconds
+        self.pre_roll_seconds = pre_roll_seconds
+        self.skip = skip
+        self.notes = queue.Queue(maxsize=queue_size)
+        self.dropped_notes = 0
+
+        self.sample_count = 0
+        self.requests = 0
+        self.nothing_played = False
+        self.buffer = None
+        self.armed = False
+        self.started = False
+        self.overflowed = False
+        self.onset = None
+        self.start_sample = None
+        self.last_loud = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.source.start(self.callback, self.take_ended)
+
+    def stop(self):
+        self.source.stop()
+
+    def callback(self, block, overflowed):
+        if overflowed:
+            self.overflowed = True
+        self.process(block[:, self.channel])
+
+    def take_ended(self, request):
+        """
+        Source thread: the source has played everything it will for note request number `request`
+        (counting from 1).  If that note hasn't started by now nothing was played for it.
+        """
+        if request == self.requests and self.armed and not self.started:
+            self.armed = False
+            self.nothing_played = True
+
+    def arm(self, request=True, silence_duration=None, max_record_seconds=None):
+        """
+        Get ready for the next note.  Audio before this is ignored.
+
+        :param request: Tell the source a note is wanted (MultiCapture does that once for all channels).
+        :param silence_duration: Seconds of silence that end this note, if not the usual.
+        :param max_record_seconds: Longest this note can be, if not the usual.
+        """
+        while not self.notes.empty():
+            self.notes.get_nowait()  # A note that finished after its consumer gave up waiting
+        if silence_duration is None:
+            self.note_silence_samples = self.silence_samples
+        else:
+            self.note_silence_samples = int(silence_duration * self.fs)
+        self.buffer = NoteBuffer(self.fs, max_record_seconds or self.max_record_seconds, self.pre_roll_seconds)
+        self.started = False
+        self.overflowed = False
+        self.nothing_played = False
+        self.fed = 0
+        self.requests += 1  # One request per arm, whether this engine or MultiCapture makes it
+        self.armed = True
+        if request:
+            self.source.note_requested()
+
+    def process(self, block):
+        """Audio thread: handle one block of samples."""
+        if self.skip:
+            dropped = min(self.skip, len(block))
+            block = block[dropped:]
+            self.skip -= dropped
+        self.sample_count += len(block)
+        if not self.armed or len(block) == 0:
+            return
+
+        buffer = self.buffer
+        levels = np.abs(block)
+        if not self.started:
+            if levels.max() <= self.start_threshold:
+                buffer.write(block)
+                return
+            buffer.trigger()
+            self.started = True
+            self.onset = buffer.length + int(np.argmax(levels > self.start_threshold))
+            self.start_sample = self.sample_count - len(block) + int(np.argmax(levels > self.start_threshold))
+            self.last_loud = self.onset
+
+        position = buffer.length
+        buffer.write(block)
+        loud = np.flatnonzero(levels[:buffer.length - position] > self.stop_threshold)
+        if len(loud):
+            self.last_loud = position + int(loud[-1])
+        if buffer.length - self.last_loud > self.note_silence_samples or buffer.full:
+            self.finish_note()
+
+    def finish_note(self):
+        self.armed = False
+        note = CapturedNote(self.buffer.view(), self.onset, self.last_loud + 1, self.start_sample, self.overflowed)
+        try:
+            self.notes.put_nowait(note)
+        except queue.Full:
+            self.dropped_notes += 1
+
+    def feed(self, on_chunk):
+        """Pass the part of the note recorded since the last call to on_chunk."""
+        buffer = self.buffer
+        if on_chunk is not None and buffer.started and buffer.length > self.fed:
+            length = buffer.length
+            on_chunk(buffer.data[self.fed:length])
+            self.fed = length
+
+    def next_note(self, timeout, on_chunk=None, poll_seconds=0.05, silence_duration=None, max_record_seconds=None):
+        """
+        Arm, wait for the next complete note and return it as a CapturedNote, or None if nothing was
+        played within `timeout` seconds (or at once, if the source says nothing was played, see
+        take_ended).  on_chunk, if given, is called here on the consumer thread
+        with each new piece of the note while it is being recorded.  silence_duration and
+        max_record_seconds override the usual ones for this note (e.g. a take of several notes).
+        """
+        self.arm(silence_duration=silence_duration, max_record_seconds=max_record_seconds)
+        waited = 0.0
+        while True:
+            try:
+                note = self.notes.get(timeout=poll_seconds)
+            except queue.Empty:
+                note = None
+            self.feed(on_chunk)
+            if note is not None:
+                return note
+            if self.nothing_played:
+                return None
+            if not self.started:
+                waited += poll_seconds
+                if waited > timeout:
+                    self.armed = False
+                    return None
+
+
+class MultiCapture:
+    """
+    Several CaptureEngines on the channels of one multi-input source, e.g. a keyboard on each
+    input of an interface all playing the same note.  There is one stream, and every block is
+    handed to each engine, which does its own onset detection on its own channel.
+
+    :param source: An audiosource with at least as many channels as the engines use.
+    :param engines: CaptureEngines made with the same source and their own channel.
+    """
+    def __init__(self, source, engines):
+        self.source = source
+        self.engines = list(engines)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self.source.start(self.callback, self.take_ended)
+
+    def stop(self):
+        self.source.stop()
+
+    def callback(self, block, overflowed):
+        for engine in self.engines:
+            engine.callback(block, overflowed)
+
+    def take_ended(self, request):
+        for engine in self.engines:
+            engine.take_ended(request)
+
+    def next_notes(self, timeout, on_chunks=None, poll_seconds=0.05):
+        """
+        Arm every engine, wait for each channel's note and return them as a list of CapturedNote,
+        with None for channels where nothing was played within `timeout` seconds (or, if the
+        source says so, nothing was played at all, see CaptureEngine.take_ended).
+
+        :param on_chunks: Optional list with an on_chunk callback (or None) per engine.
+        """
+        on_chunks = on_chunks or [None] * len(self.engines)
+        for engine in self.engines:
+            engine.arm(request=False)
+        self.source.note_requested()
+
+        notes = [None] * len(self.engines)
+        waiting = set(range(len(self.engines)))
+        waited = 0.0
+        while waiting:
+            time.sleep(poll_seconds)
+            waited += poll_seconds
+            for i in list(waiting):
+                engine = self.engines[i]
+                try:
+                    notes[i] = engine.notes.get_nowait()
+                except queue.Empty:
+                    pass
+                engine.feed(on_chunks[i])
+                if notes[i] is not None or engine.nothing_played:
+                    waiting.discard(i)
+                elif not engine.started and waited > timeout:
+                    engine.armed = False
+                    waiting.discard(i)
+        return notes
@@ -0,0 +1,192 @@
+"""
+casio2soundfont command line.
+
+    python casio2soundfont.py record casio_MT-70.yaml
+    python casio2soundfont.py record casio_MT-70.yaml casio_MT-11.yaml --inputs 1 2
+    python casio2soundfont.py detect-loops "recordings/Casio Casiotone MT-70"
+    python casio2soundfont.py normalize "recordings/Casio Casiotone MT-70"
+    python casio2soundfont.py build-sf2 casio_MT-70.yaml -o CasioMT70.sf2
+    python casio2soundfont.py patch-loops CasioMT70.sf2 "recordings/Casio Casiotone MT-70"
+    python casio2soundfont.py refine-loops CasioMT70.sf2
+    python casio2soundfont.py inspect CasioMT70.sf2
+
+Only argparse is imported up front.  numpy, yaml, librosa, sounddevice and friends are imported by
+the subcommand that needs them, so --help and the quick subcommands start fast.
+"""
+import argparse
+import os
+import sys
+
+
+def record(args):
+    import makerecordings
+
+    if len(args.config) == 1 and args.inputs is None:
+        makerecordings.main(args.config[0], args.replay, args.recalibrate, args.restart, args.continuous)
+        return
+    if args.continuous:
+        sys.exit("--continuous only works with one keyboard for now")
+    inputs = None
+    if args.inputs is not None:
+        if len(args.inputs) != len(args.config):
+            sys.exit("--inputs needs one input number per config")
+        inputs = [i - 1 for i in args.inputs]
+    makerecordings.main_multi(args.config, args.replay, args.recalibrate, inputs, args.restart)
+
+
+def detect_loops(args):
+    import batchloops
+    import loopcache
+
+    if not os.path.isdir(args.synth_dir):
+        sys.exit(f"No such directory: {args.synth_dir}")
+    cache_dir = None if args.no_cache else (args.cache_dir or loopcache.CACHE_DIR)
+    batchloops.detect_synth_loops(args.synth_dir, args.fraction, args.metric, args.workers, args.pitched,
+                                  args.method, cache_dir)
+
+
+def normalize(args):
+    import glob
+    import session
+
+    target_peak = 10 ** (args.peak_db / 20)
+    for preset_dir in sorted(glob.glob(os.path.join(args.synth_dir, "*", ""))):
+        gain = session.normalize_preset(preset_dir, target_peak)
+        if gain is not None:
+            print(f"{preset_dir}: gain {gain:0.3f}")
+
+
+def build_sf2(args):
+    import sf2build
+
+    try:
+        sf2build.build_synth(args.config, args.output, args.recordings)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+def patch_loops(args):
+    import import_loops
+
+    if args.in_place and args.output:
+        sys.exit("--in-place and --output don't go together")
+    import_loops.main(args.soundfont, args.synth_dir, args.output, args.in_place)
+
+
+def refine_loops(args):
+    import sf2refine
+
+    if not os.path.isfile(args.soundfont):
+        sys.exit(f"No such file: {args.soundfont}")
+    sf2refine.refine_bank(args.soundfont, args.window, args.radius, args.workers, args.dry_run,
+                          args.min_gain)
+
+
+def inspect(args):
+    if args.path.lower().endswith(".wav"):
+        import numpy as np
+        import session
+
+        wav = session.read_wav(args.path)
+        peak = float(np.max(np.abs(wav.audio))) if len(wav.audio) else 0.0
+        print(f"{args.path}: {len(wav.audio)} samples, {len(wav.audio) / wav.fs:0.2f} seconds at {wav.fs}Hz")
+        print(f"Peak: {20 * np.log10(peak) if peak else float('-inf'):0.2f} dB")
+        print(f"Loop: {wav.loop}  Unity note: {wav.unity_note}")
+        return
+
+    import import_loops
+    import sf2file
+
+    with sf2file.SF2Reader(args.path) as sf2:
+        lists = {}
+        for list_type, chunk_id, _, size in sf2.layout:
+            lists.setdefault(list_type, []).append(f"{chunk_id.decode(errors='replace')} {size}")
+        for list_type, sizes in lists.items():
+            print(f"LIST {list_type}: {', '.join(sizes)}" if list_type else ", ".join(sizes))
+        print()
+        for header in import_loops.parse_shdr_chunk(sf2.chunk(b'shdr')):
+            print(f"{header['name']:20} {header['start']:>9} {header['end']:>9} "
+                  f"loop {header['startLoop']:>9} {header['endLoop']:>9} {header['sampleRate']}Hz "
+                  f"key {header['originalPitch']}")
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog="casio2soundfont",
+                                     description="Record a synth without midi and turn it into a soundfont.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("record", help="record, trim, normalize and loop every preset of a synth")
+    p.add_argument("config", nargs="+",
+                   help="synth yaml file, e.g. casio_MT-70.yaml.  Give several to record keyboards on "
+                        "different inputs at the same time")
+    p.add_argument("--inputs", type=int, nargs="+", default=None,
+                   help="input number (from 1) of each keyboard, in the same order as the configs")
+    p.add_argument("--replay", metavar="DIR", default=None,
+                   help="replay takes from DIR/<preset>/<preset>-<note>.wav instead of the sound card "
+                        "(DIR/<synth_name>/<preset>/... with several configs)")
+    p.add_argument("--recalibrate", action="store_true",
+                   help="measure the noise floor again instead of using the saved profile for the device")
+    p.add_argument("--continuous", action="store_true",
+                   help="play all the notes of a preset in one take, with short gaps, and split it up")
+    p.add_argument("--restart", action="store_true",
+                   help="forget an unfinished session in the journal and record everything again")
+    p.set_defaults(func=record)
+
+    p = subparsers.add_parser("detect-loops", help="re-run loop detection over a synth's recordings")
+    p.add_argument("synth_dir", help="e.g. 'recordings/Casio Casiotone MT-70'")
+    p.add_argument("--fraction", type=float, default=0.2, help="fraction_of_expected_loop (default 0.2)")
+    p.add_argument("--metric", choices=["l1", "l2"], default="l1", help="l1 is exact, l2 is faster on long samples")
+    p.add_argument("--method", choices=["old", "fast", "multires"], default="fast",
+                   help="loop detector, multires is the quickest on long samples")
+    p.add_argument("--pitched", action="store_true",
+                   help="only try loop lengths that are whole periods of the note in the file name")
+    p.add_argument("--cache-dir", default=None, help="where to cache loop results (default .loopcache)")
+    p.add_argument("--no-cache", action="store_true", help="re-detect every file, ignoring the cache")
+    p.add_argument("--workers", type=int, default=None, help="number of processes (default: all cores)")
+    p.set_defaults(func=detect_loops)
+
+    p = subparsers.add_parser("normalize", help="normalize each preset's wavs against their overall peak")
+    p.add_argument("synth_dir", help="e.g. 'recordings/Casio Casiotone MT-70'")
+    p.add_argument("--peak-db", type=float, default=-1.0, help="target peak in dB (default -1)")
+    p.set_defaults(func=normalize)
+
+    p = subparsers.add_parser("build-sf2", help="build a soundfont straight from a synth's recordings and loops")
+    p.add_argument("config", help="synth yaml file, e.g. casio_MT-70.yaml")
+    p.add_argument("-o", "--output", default=None, help="where to write it (default <synth_name>.sf2)")
+    p.add_argument("--recordings", default="recordings",
+                   help="directory holding <synth_name>/<preset>/*.wav (default recordings)")
+    p.set_defaults(func=build_sf2)
+
+    p = subparsers.add_parser("patch-loops", help="put the selected loops into a soundfont made elsewhere")
+    p.add_argument("soundfont", help="soundfont made from the recordings")
+    p.add_argument("synth_dir", help="e.g. 'recordings/Casio Casiotone MT-70'")
+    p.add_argument("-o", "--output", default=None, help="where to write it (default modified.sf2 next to it)")
+    p.add_argument("--in-place", action="store_true",
+                   help="only rewrite the sample headers of the soundfont itself, without copying the samples")
+    p.set_defaults(func=patch_loops)
+
+    p = subparsers.add_parser("refine-loops", help="fine tune a soundfont's loops on its own 16 bit samples")
+    p.add_argument("soundfont", help=".sf2 file, changed in place")
+    p.add_argument("--window", type=int, default=1024, help="samples compared around the loop seam (default 1024)")
+    p.add_argument("--radius", type=int, default=32,
+                   help="how many samples the loop start and end can move (default 32)")
+    p.add_argument("--min-gain", type=float, default=0.05,
+                   help="only move a loop if that makes its seam score at least this much better "
+                        "(default 0.05, i.e. 5%%)")
+    p.add_argument("--workers", type=int, default=None, help="number of processes (default: all cores)")
+    p.add_argument("--dry-run", action="store_true", help="only print the report, don't change the file")
+    p.set_defaults(func=refine_loops)
+
+    p = subparsers.add_parser("inspect", help="show the chunks and samples of a soundfont, or a wav's loop")
+    p.add_argument("path", help=".sf2 or .wav file")
+    p.set_defaults(func=inspect)
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
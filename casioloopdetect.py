@@ -1,9 +1,6 @@
 import glob
 import random
-import librosa
 import numpy as np
-import sounddevice as sd
-import matplotlib.pyplot as plt
 
 def in_seconds(n_samples, sr):
     return n_samples / sr
@@ -69,24 +66,62 @@ def find_zero_crossing_old(audio, start_index):
             return i
     return start_index  # Fallback if no zero-crossing is found
 
-def find_zero_crossing(audio, start_index, direction='forward'):
+class ZeroCrossingIndex:
+    """
+    Sorted positions of every zero crossing in a signal, built once with a vectorized
+    sign change test.  Index i is a crossing when audio[i] * audio[i-1] < 0, the same test
+    find_zero_crossing has always used.
+
+    :param audio: The audio data (numpy array).
+    :param rising: Only keep crossings that go from negative to positive.
+    """
+    def __init__(self, audio, rising=False):
+        audio = np.asarray(audio)
+        if rising:
+            crossing = (audio[:-1] < 0) & (audio[1:] > 0)
+        else:
+            crossing = audio[1:] * audio[:-1] < 0
+        self.crossings = np.flatnonzero(crossing) + 1
+
+    def __len__(self):
+        return len(self.crossings)
+
+    def at_or_after(self, index):
+        """First crossing >= index, or None."""
+        i = np.searchsorted(self.crossings, index, side='left')
+        return int(self.crossings[i]) if i < len(self.crossings) else None
+
+    def at_or_before(self, index):
+        """Last crossing <= index, or None."""
+        i = np.searchsorted(self.crossings, index, side='right') - 1
+        return int(self.crossings[i]) if i >= 0 else None
+
+    def between(self, start, end):
+        """All crossings in [start, end)."""
+        lo, hi = np.searchsorted(self.crossings, [start, end], side='left')
+        return self.crossings[lo:hi]
+
+def find_zero_crossing(audio, start_index, direction='forward', index=None):
     """
     Find the first zero-crossing point in the audio signal.
 
     :param audio: The audio data (numpy array).
     :param start_index: Index to start the search from.
     :param direction: 'forward' for forward search, 'reverse' for backward search.
+    :param index: A ZeroCrossingIndex of audio, to avoid rebuilding it on every call.
     :return: Index of the zero-crossing point.
     """
+    if index is None:
+        index = ZeroCrossingIndex(audio)
     if direction == 'forward':
-        for i in range(start_index, len(audio)):
-            if audio[i] * audio[i-1] < 0:
-                return i
+        crossing = index.at_or_after(max(start_index, 1))
     elif direction == 'reverse':
-        for i in range(start_index, 0, -1):
-            if audio[i] * audio[i-1] < 0:
-                return i
-    return start_index  # Fallback if no zero-crossing is found
+        crossing = index.at_or_before(start_index)
+    else:
+        crossing = None
+    if crossing is None:
+        return start_index  # Fallback if no zero-crossing is found
+    return crossing
 
 # Example usage
 # forward_search = find_zero_crossing(audio_data, start_index)
@@ -174,7 +209,493 @@ def find_seamless_loop_old(audio, sr, fraction_of_expected_loop, min_loop_length
         return None, None, None  # No suitable loop found
 
 
+def sliding_window_scores(template, audio, first, last, metric='l1'):
+    """
+    Score `template` against every window audio[e:e + len(template)] for e in [first, last].
+
+    :param template: The window we are trying to match (numpy array).
+    :param audio: The audio data (numpy array).
+    :param first: First window start to score.
+    :param last: Last window start to score (inclusive).
+    :param metric: 'l1' for the exact mean absolute difference used by waveform_similarity,
+                   'l2' for the root mean square difference computed with cumulative sums and
+                   an FFT cross-correlation.
+    :return: numpy array of scores, one per window start from first to last.
+    """
+    window_size = len(template)
+    last = min(last, len(audio) - window_size)
+    if window_size == 0 or last < first:
+        return np.empty(0)
+
+    if metric == 'l1':
+        windows = np.lib.stride_tricks.sliding_window_view(audio[first:last + window_size], window_size)
+        return l1_scores_at(template, windows, np.arange(len(windows)))
+
+    if metric == 'l2':
+        segment = np.asarray(audio[first:last + window_size], dtype=np.float64)
+        template = np.asarray(template, dtype=np.float64)
+        n_fft = 1 << int(len(segment) + window_size - 1).bit_length()
+        correlation = np.fft.irfft(np.fft.rfft(segment, n_fft) * np.conj(np.fft.rfft(template, n_fft)), n_fft)
+        correlation = correlation[:last - first + 1]
+        energy = np.concatenate(([0.0], np.cumsum(segment ** 2)))
+        window_energy = energy[window_size:] - energy[:-window_size]
+        squared_error = np.sum(template ** 2) + window_energy - 2 * correlation
+        return np.sqrt(np.maximum(squared_error, 0.0) / window_size)
+
+    raise ValueError(f"Unknown metric: {metric}")
+
+
+# Differences held in memory at once by the L1 scorers.  Kept small enough (256KB of float32)
+# to stay in cache, larger batches are slower than scoring one window at a time.
+L1_BLOCK = 1 << 16
+
+def l1_scores_at(template, windows, indices, out=None):
+    """
+    Mean absolute difference between `template` and windows[i] for each i in `indices`, computed
+    in cache sized blocks.  Scores are written to out[indices] if out is given.
+    """
+    template = np.asarray(template, dtype=windows.dtype)
+    scores = np.empty(len(indices))
+    batch = max(1, L1_BLOCK // max(1, len(template)))
+    for i in range(0, len(indices), batch):
+        scores[i:i + batch] = np.mean(np.abs(windows[indices[i:i + batch]] - template), axis=1)
+    if out is not None:
+        out[indices] = scores
+    return scores
+
+
+def best_l1_window(template, audio, first, last):
+    """
+    The window start e in [first, last] with the lowest mean absolute difference to `template`,
+    exactly as sliding_window_scores(..., metric='l1') would pick it (latest of equal minima),
+    without scoring every window.
+
+    mean|d| >= mean(d**2) / max|d|, so the RMS scores (one FFT) give a lower bound on every L1
+    score.  Windows are scored in order of that bound until it passes the best score found.
+
+    :return: (e, score), or (None, None) if there are no windows.
+    """
+    window_size = len(template)
+    rms = sliding_window_scores(template, audio, first, last, metric='l2')
+    if len(rms) == 0:
+        return None, None
+    segment = audio[first:first + len(rms) - 1 + window_size]
+    largest_difference = float(np.max(np.abs(segment))) + float(np.max(np.abs(template)))
+    # Leave some room for rounding in the FFT and float32 sums, the bound has to stay below
+    lower = rms ** 2 / max(largest_difference, 1e-30) * (1 - 1e-4) - 1e-7
+
+    windows = np.lib.stride_tricks.sliding_window_view(segment, window_size)
+    scores = np.full(len(rms), np.inf)
+    order = np.argsort(lower, kind='stable')
+    best_score, n, step = np.inf, 0, 64
+    while n < len(order) and lower[order[n]] <= best_score:
+        indices = order[n:n + step]
+        indices = indices[lower[indices] <= best_score]
+        best_score = min(best_score, float(np.min(l1_scores_at(template, windows, indices, out=scores))))
+        n, step = n + step, min(2 * step, 4096)
+
+    best = len(scores) - 1 - np.argmin(scores[::-1])
+    return first + int(best), float(scores[best])
+
+
+def find_seamless_loop_fast(audio, sr, fraction_of_expected_loop, min_loop_length_frac=0.05, metric='l1',
+                            zero_crossings=None):
+    """
+    Vectorized version of find_seamless_loop_old.  Searches the same loop starts and end windows,
+    but scores all of the candidate end points at once instead of one at a time.
+
+    :param audio: The audio data (numpy array).
+    :param sr: Sample rate of the audio data.
+    :param fraction_of_expected_loop: Size of the comparison window as a fraction of the audio.
+    :param min_loop_length_frac: Minimum loop length as a fraction of the audio.
+    :param metric: 'l1' gives exactly the same answer as find_seamless_loop_old (see best_l1_window),
+                   'l2' is faster still and scores with the RMS difference.
+    :param zero_crossings: Optional ZeroCrossingIndex of audio, if the caller already has one.
+    :return: (loop_start, loop_end, score), or (None, None, None) if no loop was found.
+    """
+    window_size = int(len(audio) * fraction_of_expected_loop)
+    start_search_point = int(len(audio) * 0.30)
+    end_search_point = int(len(audio) * 0.60)
+    min_loop_length = int(len(audio) * min_loop_length_frac)
+
+    loop_start = find_zero_crossing(audio, start_search_point, index=zero_crossings)
+    start_window = audio[loop_start:loop_start + window_size]
+
+    first = loop_start + min_loop_length
+    if metric == 'l1':
+        loop_end, score = best_l1_window(start_window, audio, first, end_search_point)
+        if loop_end is None:
+            return None, None, None  # No suitable loop found
+        return loop_start, loop_end, score
+
+    scores = sliding_window_scores(start_window, audio, first, end_search_point, metric=metric)
+    if len(scores) == 0:
+        return None, None, None  # No suitable loop found
+
+    # find_seamless_loop_old walks backwards and keeps the first best, so prefer the latest minimum
+    best = len(scores) - 1 - np.argmin(scores[::-1])
+    return loop_start, first + int(best), float(scores[best])
+
+
+def multi_start_scores(audio, starts, window_size, first, last):
+    """
+    RMS difference between the window at each start and every window audio[e:e + window_size]
+    for e in [first, last].  All starts share one FFT of the audio segment, and the templates
+    are transformed together in batches.
+
+    :return: 2D numpy array, one row per start, one column per window start from first to last.
+    """
+    segment = np.asarray(audio[first:last + window_size], dtype=np.float64)
+    n_ends = len(segment) - window_size + 1
+    n_fft = 1 << int(len(segment) + window_size - 1).bit_length()
+    segment_fft = np.fft.rfft(segment, n_fft)
+    energy = np.concatenate(([0.0], np.cumsum(segment ** 2)))
+    window_energy = energy[window_size:] - energy[:-window_size]
+
+    scores = np.empty((len(starts), n_ends))
+    # Keep each batch of template spectra around 64MB
+    batch = max(1, (1 << 22) // (n_fft // 2 + 1))
+    for i in range(0, len(starts), batch):
+        templates = np.stack([np.asarray(audio[s:s + window_size], dtype=np.float64) for s in starts[i:i + batch]])
+        correlation = np.fft.irfft(segment_fft * np.conj(np.fft.rfft(templates, n_fft, axis=1)), n_fft, axis=1)
+        template_energy = np.sum(templates ** 2, axis=1, keepdims=True)
+        squared_error = template_energy + window_energy - 2 * correlation[:, :n_ends]
+        scores[i:i + batch] = np.sqrt(np.maximum(squared_error, 0.0) / window_size)
+    return scores
+
+
+def find_loop_candidates(audio, sr, fraction_of_expected_loop=0.2, min_loop_length_frac=0.05,
+                         start_region=(0.20, 0.40), end_search_fraction=0.60,
+                         top_k=5, max_starts=64, min_separation=None):
+    """
+    Search many loop starts at once and return the best (start, end, score) candidates.
+
+    Every zero crossing inside start_region is a candidate start (thinned evenly to max_starts),
+    and each one is scored against every end window up to end_search_fraction of the audio.
+
+    :param audio: The audio data (numpy array).
+    :param sr: Sample rate of the audio data.
+    :param fraction_of_expected_loop: Size of the comparison window as a fraction of the audio.
+    :param min_loop_length_frac: Minimum loop length as a fraction of the audio.
+    :param start_region: (from, to) fractions of the audio to take loop starts from.
+    :param end_search_fraction: Latest loop end, as a fraction of the audio.
+    :param top_k: How many candidates to return.
+    :param max_starts: Upper limit on the number of starts scored.
+    :param min_separation: Candidates whose start and end are both within this many samples of a
+                           better candidate are dropped as duplicates.  Defaults to 10ms.
+    :return: List of (loop_start, loop_end, score), best first.
+    """
+    window_size = int(len(audio) * fraction_of_expected_loop)
+    min_loop_length = int(len(audio) * min_loop_length_frac)
+    end_search_point = min(int(len(audio) * end_search_fraction), len(audio) - window_size)
+    if min_separation is None:
+        min_separation = int(sr * 0.01)
+
+    region_start, region_end = (int(len(audio) * f) for f in start_region)
+    starts = ZeroCrossingIndex(audio[:region_end]).between(region_start, region_end)
+    # Every start window has to fit in the audio, multi_start_scores stacks them
+    starts = starts[(starts + min_loop_length <= end_search_point) & (starts + window_size <= len(audio))]
+    if len(starts) == 0 or window_size == 0:
+        return []
+    if len(starts) > max_starts:
+        starts = starts[np.linspace(0, len(starts) - 1, max_starts).astype(int)]
+
+    first = int(starts[0]) + min_loop_length
+    scores = multi_start_scores(audio, starts, window_size, first, end_search_point)
+    ends = np.arange(first, first + scores.shape[1])
+    # Ends closer than min_loop_length to their start are not allowed
+    scores[ends[None, :] < starts[:, None] + min_loop_length] = np.inf
+
+    # Only the best few ends of each start can make it into the top K.  Each accepted candidate
+    # rules out at most 2 * min_separation + 1 ends of a start.
+    per_start = min(scores.shape[1], top_k * (2 * min_separation + 1))
+    best = np.argpartition(scores, per_start - 1, axis=1)[:, :per_start]
+    rows = np.repeat(np.arange(len(starts)), per_start)
+    cols = best.ravel()
+    order = np.argsort(scores[rows, cols], kind='stable')
+
+    candidates = []
+    for i in order:
+        score = scores[rows[i], cols[i]]
+        if not np.isfinite(score):
+            break
+        loop_start, loop_end = int(starts[rows[i]]), int(ends[cols[i]])
+        if any(abs(loop_start - s) <= min_separation and abs(loop_end - e) <= min_separation
+               for s, e, _ in candidates):
+            continue
+        candidates.append((loop_start, loop_end, float(score)))
+        if len(candidates) == top_k:
+            break
+    return candidates
+
+
+def find_seamless_loop_multires(audio, sr, fraction_of_expected_loop, min_loop_length_frac=0.05, metric='l1',
+                                decimation=16, n_regions=4, subsample=False, zero_crossings=None):
+    """
+    Coarse-to-fine version of find_seamless_loop_fast.  All end points are scored on a copy of
+    the audio decimated by `decimation`, the best `n_regions` are kept, and only those are
+    re-scored at full resolution.  At most n_regions * (2 * decimation + 1) full resolution
+    windows are compared, however long the sample is.
+
+    :param audio: The audio data (numpy array).
+    :param sr: Sample rate of the audio data.
+    :param fraction_of_expected_loop: Size of the comparison window as a fraction of the audio.
+    :param min_loop_length_frac: Minimum loop length as a fraction of the audio.
+    :param metric: 'l1' or 'l2', see sliding_window_scores.
+    :param decimation: Decimation factor of the coarse search.
+    :param n_regions: How many coarse matches to refine.
+    :param subsample: Also return how far between samples the best match really is.
+    :param zero_crossings: Optional ZeroCrossingIndex of audio, if the caller already has one.
+    :return: (loop_start, loop_end, score), or (None, None, None) if no loop was found.  loop_end is
+             always a whole sample index.  With subsample=True a fourth value is added, the offset
+             (between -0.5 and 0.5 samples, 0.0 if it couldn't be refined) of the best match from
+             loop_end, e.g. for resampling the loop to a fractional length.
+    """
+    window_size = int(len(audio) * fraction_of_expected_loop)
+    start_search_point = int(len(audio) * 0.30)
+    end_search_point = min(int(len(audio) * 0.60), len(audio) - window_size)
+    min_loop_length = int(len(audio) * min_loop_length_frac)
+
+    loop_start = find_zero_crossing(audio, start_search_point, index=zero_crossings)
+    start_window = audio[loop_start:loop_start + window_size]
+    first = loop_start + min_loop_length
+    if window_size == 0 or end_search_point < first:
+        return (None, None, None, None) if subsample else (None, None, None)  # No suitable loop found
+
+    # Coarse pass: block average (a cheap low pass) and keep every decimation'th sample
+    n_blocks = len(audio) // decimation
+    coarse = np.asarray(audio[:n_blocks * decimation], dtype=np.float64).reshape(n_blocks, decimation).mean(axis=1)
+    coarse_start = loop_start // decimation
+    coarse_window = coarse[coarse_start:coarse_start + max(1, window_size // decimation)]
+    coarse_first = -(-first // decimation)
+    coarse_scores = sliding_window_scores(coarse_window, coarse, coarse_first, end_search_point // decimation,
+                                          metric=metric)
+
+    regions = []
+    for i in np.argsort(coarse_scores, kind='stable'):
+        if all(abs(i - r) > 2 for r in regions):
+            regions.append(i)
+        if len(regions) == n_regions:
+            break
+    if not regions:
+        regions = [0]
+
+    # Fine pass: every sample within one coarse step of each region
+    centres = (coarse_first + np.array(regions)) * decimation
+    ends = np.unique((centres[:, None] + np.arange(-decimation, decimation + 1)).ravel())
+    ends = ends[(ends >= first) & (ends <= end_search_point)]
+    if len(ends) == 0:
+        return (None, None, None, None) if subsample else (None, None, None)  # No suitable loop found
+    scores = window_scores_at(start_window, audio, ends, metric=metric)
+    best = len(scores) - 1 - np.argmin(scores[::-1])
+    loop_end, score = int(ends[best]), float(scores[best])
+    if not subsample:
+        return loop_start, loop_end, score
+
+    offset = 0.0
+    if 0 < best < len(ends) - 1 and ends[best - 1] == loop_end - 1 and ends[best + 1] == loop_end + 1:
+        # Parabolic interpolation around the best end
+        left, centre, right = scores[best - 1:best + 2]
+        denominator = left - 2 * centre + right
+        if denominator > 0:
+            offset = float(0.5 * (left - right) / denominator)
+    return loop_start, loop_end, score, offset
+
+
+NOTE_OFFSETS = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+def note_to_midi(note):
+    """
+    MIDI note number of a note name like 'C1', 'F#3' or 'Bb4' (C4 = 60).
+    """
+    name, octave = note[0].upper(), note[1:]
+    semitone = NOTE_OFFSETS[name]
+    if octave[:1] == '#':
+        semitone, octave = semitone + 1, octave[1:]
+    elif octave[:1] == 'b':
+        semitone, octave = semitone - 1, octave[1:]
+    return 12 * (int(octave) + 1) + semitone
+
+def note_to_frequency(note):
+    """
+    Frequency in Hz of a note name like 'C1', 'F#3' or 'Bb4' (A4 = 440Hz).
+    """
+    return 440.0 * 2 ** ((note_to_midi(note) - 69) / 12)
+
+def note_from_filename(file_path):
+    """
+    'recordings/Casio Casiotone MT-70/flute/flute-C1.wav' -> 'C1'
+    """
+    return file_path.rsplit('/', 1)[-1].rsplit('.', 1)[0].rsplit('-', 1)[-1]
+
+def estimate_period(audio, sr, expected_period=None, tolerance=0.1):
+    """
+    Estimate the period of a (roughly) periodic signal from its autocorrelation.
+
+    :param audio: The audio data (numpy array), a few periods or more.
+    :param sr: Sample rate of the audio data.
+    :param expected_period: If given, only look for a period within tolerance of this many samples.
+    :param tolerance: How far (as a fraction) the period may be from expected_period.
+    :return: Period in samples (float, refined between samples), or None if the audio is too short.
+    """
+    if expected_period is None:
+        min_lag, max_lag = int(sr / 2000), int(sr / 30)
+    else:
+        min_lag = max(1, int(expected_period * (1 - tolerance)))
+        max_lag = int(np.ceil(expected_period * (1 + tolerance)))
+    if len(audio) < 2 * max_lag or max_lag <= min_lag:
+        return expected_period
+
+    audio = np.asarray(audio, dtype=np.float64)
+    audio = audio - np.mean(audio)
+    n_fft = 1 << int(2 * len(audio)).bit_length()
+    spectrum = np.fft.rfft(audio, n_fft)
+    autocorrelation = np.fft.irfft(spectrum * np.conj(spectrum), n_fft)[:max_lag + 2]
+    # Divide by the overlap so long lags aren't penalized
+    autocorrelation /= len(audio) - np.arange(len(autocorrelation))
+
+    lag = min_lag + int(np.argmax(autocorrelation[min_lag:max_lag + 1]))
+    # Parabolic interpolation around the peak
+    left, centre, right = autocorrelation[lag - 1:lag + 2]
+    denominator = left - 2 * centre + right
+    offset = 0.5 * (left - right) / denominator if denominator < 0 else 0.0
+    return lag + offset
+
+def window_scores_at(template, audio, ends, metric='l1'):
+    """
+    Score `template` against the windows audio[e:e + len(template)] for each e in `ends`.
+    """
+    window_size = len(template)
+    windows = np.lib.stride_tricks.sliding_window_view(audio, window_size)
+    if metric == 'l1':
+        return l1_scores_at(template, windows, ends)
+    if metric != 'l2':
+        raise ValueError(f"Unknown metric: {metric}")
+    template = np.asarray(template, dtype=windows.dtype)
+    scores = np.empty(len(ends))
+    batch = max(1, (1 << 22) // max(1, window_size))
+    for i in range(0, len(ends), batch):
+        difference = windows[ends[i:i + batch]] - template
+        scores[i:i + batch] = np.sqrt(np.mean(difference.astype(np.float64) ** 2, axis=1))
+    return scores
+
+def find_seamless_loop_pitched(audio, sr, note, fraction_of_expected_loop=0.2, min_loop_length_frac=0.05,
+                               slack=2, metric='l1', zero_crossings=None):
+    """
+    Like find_seamless_loop_fast, but only tries loop ends that are a whole number of periods
+    after the loop start.  The period comes from the note name, refined on the audio itself.
+
+    :param audio: The audio data (numpy array).
+    :param sr: Sample rate of the audio data.
+    :param note: The note that was recorded, e.g. 'C1' (see note_from_filename).
+    :param fraction_of_expected_loop: Size of the comparison window as a fraction of the audio.
+    :param min_loop_length_frac: Minimum loop length as a fraction of the audio.
+    :param slack: How many samples either side of each period multiple to try.
+    :param metric: 'l1' or 'l2', see sliding_window_scores.
+    :param zero_crossings: Optional ZeroCrossingIndex of audio, if the caller already has one.
+    :return: (loop_start, loop_end, score), or (None, None, None) if no loop was found.
+    """
+    window_size = int(len(audio) * fraction_of_expected_loop)
+    start_search_point = int(len(audio) * 0.30)
+    end_search_point = min(int(len(audio) * 0.60), len(audio) - window_size)
+    min_loop_length = int(len(audio) * min_loop_length_frac)
+
+    loop_start = find_zero_crossing(audio, start_search_point, index=zero_crossings)
+    start_window = audio[loop_start:loop_start + window_size]
+
+    expected_period = sr / note_to_frequency(note)
+    period = estimate_period(audio[loop_start:loop_start + int(expected_period * 16)], sr, expected_period)
+
+    multiples = np.arange(max(1, int(np.ceil(min_loop_length / period))),
+                          int((end_search_point - loop_start) / period) + 1)
+    ends = np.round(loop_start + multiples * period).astype(int)
+    ends = np.unique((ends[:, None] + np.arange(-slack, slack + 1)).ravel())
+    ends = ends[(ends >= loop_start + min_loop_length) & (ends <= end_search_point)]
+    if len(ends) == 0 or window_size == 0:
+        return None, None, None  # No suitable loop found
+
+    scores = window_scores_at(start_window, audio, ends, metric=metric)
+    best = len(scores) - 1 - np.argmin(scores[::-1])
+    return loop_start, int(ends[best]), float(scores[best])
+
+
+class StreamingLoopDetector:
+    """
+    Loop detection that runs while a note is being recorded.  Feed it chunks with add() as they
+    arrive, and finish() has the loop ready as soon as the recording stops.
+
+    The final length of the note isn't known up front, so the loop start is the first zero
+    crossing after start_seconds (rather than a fraction of the note).  Every end window is
+    scored once, as soon as the audio for it has arrived, and finish() picks the best one
+    before search_end_fraction of the note.  Indices are relative to the first sample added.
+
+    :param sr: Sample rate of the audio.
+    :param start_seconds: Where to start looking for the loop start.
+    :param window_seconds: Size of the comparison window.
+    :param min_loop_seconds: Minimum loop length.
+    :param search_end_fraction: Latest loop end, as a fraction of the final note length.
+    :param max_seconds: Longest note that will be added.
+    :param metric: 'l1' or 'l2', see sliding_window_scores.
+    """
+    def __init__(self, sr, start_seconds=1.0, window_seconds=0.5, min_loop_seconds=0.5,
+                 search_end_fraction=0.6, max_seconds=15, metric='l2'):
+        self.start_search_point = int(start_seconds * sr)
+        self.window_size = int(window_seconds * sr)
+        self.min_loop_length = int(min_loop_seconds * sr)
+        self.search_end_fraction = search_end_fraction
+        self.metric = metric
+        self.audio = np.zeros(int(max_seconds * sr), dtype=np.float32)
+        self.scores = np.full(len(self.audio), np.inf)
+        self.n_samples = 0
+        self.loop_start = None
+        self.start_window = None
+        self.next_end = None
+
+    def add(self, chunk):
+        chunk = chunk[:len(self.audio) - self.n_samples]
+        self.audio[self.n_samples:self.n_samples + len(chunk)] = chunk
+        self.n_samples += len(chunk)
+
+        if self.loop_start is None and self.n_samples > self.start_search_point + 1:
+            search_from = max(self.start_search_point, 1) - 1
+            crossing = ZeroCrossingIndex(self.audio[search_from:self.n_samples]).at_or_after(1)
+            if crossing is not None:
+                self.loop_start = search_from + crossing
+                self.next_end = self.loop_start + self.min_loop_length
+
+        if self.start_window is None and self.loop_start is not None:
+            if self.n_samples >= self.loop_start + self.window_size:
+                self.start_window = self.audio[self.loop_start:self.loop_start + self.window_size]
+
+        # Score in batches of at least a quarter window, so tiny chunks don't each pay for an FFT
+        if self.start_window is not None and self.n_samples - self.window_size - self.next_end >= self.window_size // 4:
+            self.score_pending()
+
+    def score_pending(self):
+        last = self.n_samples - self.window_size
+        if self.start_window is None or last < self.next_end:
+            return
+        self.scores[self.next_end:last + 1] = sliding_window_scores(self.start_window, self.audio[:self.n_samples],
+                                                                    self.next_end, last, metric=self.metric)
+        self.next_end = last + 1
+
+    def finish(self):
+        """
+        :return: (loop_start, loop_end, score), or (None, None, None) if no loop was found.
+        """
+        self.score_pending()
+        if self.start_window is None:
+            return None, None, None
+        end_search_point = int(self.n_samples * self.search_end_fraction)
+        scores = self.scores[self.loop_start + self.min_loop_length:end_search_point + 1]
+        if len(scores) == 0 or not np.isfinite(scores).any():
+            return None, None, None  # No suitable loop found
+        best = len(scores) - 1 - np.argmin(scores[::-1])
+        return self.loop_start, self.loop_start + self.min_loop_length + int(best), float(scores[best])
+
+
 def play_loop_with_intro(audio, sr, loop_start, loop_end, repeat_times=10):
+    import sounddevice as sd  # Only needed for playback, so the detectors also work without a sound device
     intro_audio = audio[:loop_start]
     outro_audio = audio[loop_end:]
     loop_audio = audio[loop_start:loop_end]
@@ -183,7 +704,28 @@ def play_loop_with_intro(audio, sr, loop_start, loop_end, repeat_times=10):
     sd.play(full_audio, sr, blocksize=1024*3)
     sd.wait()  # Wait for the playback to finish
 
-find_seamless_loop = find_seamless_loop_old
+LOOP_DETECTORS = {
+    'old': find_seamless_loop_old,
+    'fast': find_seamless_loop_fast,
+    'multires': find_seamless_loop_multires,
+}
+
+# Bump a detector's version when the loops it finds change, so cached results (see loopcache.py) are redone
+DETECTOR_VERSIONS = {
+    'old': 1,
+    'fast': 2,
+    'multires': 2,
+    'pitched': 1,
+}
+
+def find_seamless_loop(audio, sr, fraction_of_expected_loop, min_loop_length_frac=0.05, method='fast', **kwargs):
+    """
+    Find loop points with one of the LOOP_DETECTORS.  Extra keyword arguments (metric, decimation...)
+    are passed on to the detector.
+
+    :return: (loop_start, loop_end, score), or (None, None, None) if no loop was found.
+    """
+    return LOOP_DETECTORS[method](audio, sr, fraction_of_expected_loop, min_loop_length_frac, **kwargs)
 
 def plot_waveform(audio, sr, loop_start=None, loop_end=None, title='Audio Waveform'):
     """
@@ -195,6 +737,8 @@ def plot_waveform(audio, sr, loop_start=None, loop_end=None, title='Audio Wavefo
     :param loop_end: Sample index where the loop ends (optional).
     :param title: Title of the plot (optional).
     """
+    import matplotlib.pyplot as plt
+
     if not isinstance(audio, list):
         audio = [audio]
 
@@ -216,7 +760,12 @@ def plot_waveform(audio, sr, loop_start=None, loop_end=None, title='Audio Wavefo
     plt.tight_layout()
     plt.show()
 
-def test():
+def test(use_cache=True):
+    import librosa
+    import loopcache
+
+    cache = loopcache.LoopCache() if use_cache else None
+
     wave_files = glob.glob("recordings/Casio Casiotone MT-11/*/*.wav")
     random.shuffle(wave_files)
 
@@ -227,7 +776,7 @@ def test():
         # Find the best loop points
 
         fraction_of_expected_loop = 0.2
-        loop_start, loop_end, score = find_seamless_loop(audio, sr, fraction_of_expected_loop)
+        loop_start, loop_end, score = loopcache.find_seamless_loop(audio, sr, fraction_of_expected_loop, cache=cache)
         if loop_start is not None and loop_end is not None:
             print(f"Best loop from {loop_start} to {loop_end}. Score: {score}")
         else:
@@ -1,4 +1,5 @@
 import casioloopdetect
+import loopcache
 import librosa
 
 # recordings/Casio Casiotone MT-70/wood wind/wood wind-B3.wav,44114,80130,0.036664582788944244,good
@@ -19,7 +20,8 @@ for fraction_of_expected_loop in [0.2]:
     file_path='recordings/Casio Casiotone MT-70/pipe organ/pipe organ-D4.wav'
     file_path='recordings/Casio Casiotone MT-70/flute/flute-C1.wav'
     audio, sr = librosa.load(file_path, sr=None)
-    loop_start, loop_end, score = casioloopdetect.find_seamless_loop(audio, sr, fraction_of_expected_loop=0.2)
+    loop_start, loop_end, score = loopcache.find_seamless_loop(audio, sr, fraction_of_expected_loop=0.2,
+                                                               cache=loopcache.LoopCache())
 
     plot_waveform(audio, sr, loop_start=loop_start, loop_end=loop_end, title=file_path)
 
@@ -1,5 +1,8 @@
 import os
 import struct
+import numpy as np
+import loopdb
+import sf2file
 
 def read_chunk_header(file):
     header = file.read(8)
@@ -51,7 +54,9 @@ def read_sf2(file_path):
     return sf2_data
 
 def write_sf2(file_path, sf2_data):
-    with open(file_path, 'wb') as file:
+    # Written next to it and renamed over, so a crash never leaves half a soundfont behind
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, 'wb') as file:
         # Write the RIFF header
         riff_size = calculate_total_riff_size(sf2_data)
         riff_header = struct.pack('<4sI', b'RIFF', riff_size) + sf2_data['format'].encode('utf-8')
@@ -70,6 +75,10 @@ def write_sf2(file_path, sf2_data):
             else:  # Regular chunk
                 file.write(struct.pack('<4sI', chunk['id'], len(chunk['data'])))
                 file.write(chunk['data'])
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+    sf2file.fsync_dir(file_path)
 
 def calculate_total_riff_size(sf2_data):
     size = 4  # For format type (e.g., 'sfbk')
@@ -102,51 +111,23 @@ def describe_chunk(chunk):
 
 
 def parse_shdr_chunk(chunk_data):
+    # One np.frombuffer for the whole table instead of a struct.unpack per header
+    table = sf2file.decode_table(b'shdr', chunk_data)
     sample_headers = []
-    header_format = '20sIIIIIBbHH'  # Adjusted format string for the SampleHeader structure
-    header_size = struct.calcsize(header_format)  # Calculate the size of one header
-
-    for i in range(0, len(chunk_data) - header_size + 1, header_size):
-        try:
-            unpacked_data = struct.unpack_from(header_format, chunk_data, i)
-        except struct.error:
-            # Stop if there's not enough data left to read a full header
-            break
-
-        sample_header = {
-            'name': unpacked_data[0].split(b'\x00', 1)[0].decode('utf-8', errors='ignore'),
-            'start': unpacked_data[1],
-            'end': unpacked_data[2],
-            'startLoop': unpacked_data[3],
-            'endLoop': unpacked_data[4],
-            'sampleRate': unpacked_data[5],
-            'originalPitch': unpacked_data[6],
-            'pitchCorrection': unpacked_data[7],
-            'link': unpacked_data[8],
-            'type': unpacked_data[9],
-        }
+    for row in table.tolist():
+        sample_header = dict(zip(sf2file.SHDR.names, row))
+        sample_header['name'] = sf2file.decode_name(sample_header['name'])
         sample_headers.append(sample_header)
-
     return sample_headers
 
 def pack_shdr_chunk(sample_headers):
-    packed_data = b''
-    header_format = '20sIIIIIBbHH'
-
-    for header in sample_headers:
-        packed_data += struct.pack(header_format,
-                                   header['name'].encode('utf-8'),
-                                   header['start'],
-                                   header['end'],
-                                   header['startLoop'],
-                                   header['endLoop'],
-                                   header['sampleRate'],
-                                   header['originalPitch'],
-                                   header['pitchCorrection'],
-                                   header['link'],
-                                   header['type'],
-        )
-    return packed_data
+    table = np.zeros(len(sample_headers), dtype=sf2file.SHDR)
+    for field in sf2file.SHDR.names:
+        if field == 'name':
+            table['name'] = [header['name'].encode('utf-8')[:20] for header in sample_headers]
+        else:
+            table[field] = [header[field] for header in sample_headers]
+    return sf2file.encode_table(table)
 
 def get_idx_shdr(shdr_data, name):
     for idx, sample_header in enumerate(shdr_data):
@@ -185,48 +166,84 @@ def get_shdr_data(sf2_data):
 #shdr_data[0]['startLoop'] = 66666
 #shdr_data[0]['endLoop'] = 66666
 
-sf2_dir = "/home/equant/projects/audio/fluidpatcher/SquishBox/sf2/"
-soundfont_file = 'CasioMT11.sf2'
-soundfont_path = os.path.join(sf2_dir, soundfont_file)
-
-sf2_data = read_sf2(soundfont_path)
-shdr_data = get_shdr_data(sf2_data)
-original_shrd_data = shdr_data.copy()
-
-synth_dir = "/home/equant/projects/audio/casio2soundfont/recordings/Casio Casiotone MT-11"
-
-for idx, sample in enumerate(shdr_data):
-    print(f"Sample: {sample['name']}")
-    if sample['name'] == 'EOS':
-        continue
-    preset = sample['name'][:-3]
-    preset_dir = os.path.join(synth_dir, preset)
-    loop_file_path = os.path.join(preset_dir, "selected_loops.txt")
-    if not os.path.isfile(loop_file_path):
-        shdr_data[idx]['startLoop'] = 0
-        shdr_data[idx]['endLoop'] = 0
-        print(f"No loop file found for {preset}")
-        continue
-    loop_dict = get_loops_from_file(loop_file_path)
-    wavefile = sample['name'] + ".wav"
-    sample_length = shdr_data[idx]['end'] - shdr_data[idx]['start']
-    loop_quality = loop_dict[wavefile][3]
-    print(f"         {loop_dict[wavefile][0]}")
-    print(f"         {loop_dict[wavefile][1]}")
-    shdr_data[idx]['startLoop'] = sample['start'] + loop_dict[wavefile][0]
-    shdr_data[idx]['endLoop'] = sample['start'] + loop_dict[wavefile][1]
-
-new_shdr = pack_shdr_chunk(shdr_data)
-sf2_data['chunks'][2]['sub_chunks'][b'shdr'] = new_shdr
-new_sounndfont_path = os.path.join(sf2_dir, "modified.sf2")
-write_sf2(new_sounndfont_path, sf2_data)
-
-#modified_sf2_data = read_sf2(new_sounndfont_path)
-#modified_shdr_data = get_shdr_data(modified_sf2_data)
-
-#print(original_shrd_data[-2])
-#print(shdr_data[-2])
-#print(modified_shdr_data[-2])
-
-#print(sf2_data['chunks'][2]['sub_chunks'][b'shdr'])
-#print(modified_sf2_data['chunks'][2]['sub_chunks'][b'shdr'])
+SF2_DIR = "/home/equant/projects/audio/fluidpatcher/SquishBox/sf2/"
+SOUNDFONT_FILE = 'CasioMT11.sf2'
+SYNTH_DIR = "/home/equant/projects/audio/casio2soundfont/recordings/Casio Casiotone MT-11"
+
+def patch_shdr(shdr, synth_dir):
+    """
+    Set the loop points of every sample in shdr (a sf2file.SHDR table, changed in place) from
+    the synth's loop database (see loopdb.bank_loops), fetched once for the whole bank.
+    Samples are named <preset>-<note>, like the wav files they were made from.  The loops are
+    gathered first and then set in one go.
+    """
+    loops = loopdb.bank_loops(synth_dir)
+    presets_with_loops = {preset for preset, _ in loops}
+    index, loop_starts, loop_ends = [], [], []
+    no_loops = []
+    for idx, name in enumerate(shdr['name']):
+        name = sf2file.decode_name(name)
+        # Written back without whatever junk followed the name's terminating zero
+        shdr['name'][idx] = name.encode('utf-8')
+        print(f"Sample: {name}")
+        if name == 'EOS':
+            continue
+        preset, _, note = name.rpartition('-')
+        if preset not in presets_with_loops:
+            no_loops.append(idx)
+            print(f"No loops found for {preset}")
+            continue
+        loop = loops.get((preset, note))
+        if loop is None or loop.loop_start is None or loop.loop_end is None:
+            print(f"         No loop for {name}")
+            continue
+        print(f"         {loop.loop_start}")
+        print(f"         {loop.loop_end}")
+        index.append(idx)
+        loop_starts.append(loop.loop_start)
+        loop_ends.append(loop.loop_end)
+
+    shdr['startLoop'][no_loops] = 0
+    shdr['endLoop'][no_loops] = 0
+    sf2file.set_relative_loops(shdr, index, loop_starts, loop_ends)
+    return shdr
+
+def patch_loops(sf2_data, synth_dir):
+    """patch_shdr on a soundfont read with read_sf2."""
+    pdta = sf2_data['chunks'][2]['sub_chunks']
+    shdr = sf2file.decode_table(b'shdr', pdta[b'shdr']).copy()
+    patch_shdr(shdr, synth_dir)
+    pdta[b'shdr'] = sf2file.encode_table(shdr)
+    return sf2_data
+
+def patch_in_place(soundfont_path, synth_dir):
+    """
+    Put the loops straight into soundfont_path.  Only the shdr chunk is rewritten (see
+    sf2file.patch_chunk), the sample data isn't even read.
+    """
+    if sf2file.recover_patch(soundfont_path):
+        print(f"Finished an interrupted patch of {soundfont_path}")
+    with sf2file.SF2Reader(soundfont_path) as sf2:
+        shdr = sf2.table(b'shdr').copy()
+    patch_shdr(shdr, synth_dir)
+    sf2file.patch_chunk(soundfont_path, b'shdr', sf2file.encode_table(shdr))
+
+def main(soundfont_path=None, synth_dir=SYNTH_DIR, output_path=None, in_place=False):
+    if soundfont_path is None:
+        soundfont_path = os.path.join(SF2_DIR, SOUNDFONT_FILE)
+    if in_place:
+        patch_in_place(soundfont_path, synth_dir)
+        print(f"Patched {soundfont_path}")
+        return soundfont_path
+    if output_path is None:
+        output_path = os.path.join(os.path.dirname(soundfont_path), "modified.sf2")
+
+    sf2_data = read_sf2(soundfont_path)
+    patch_loops(sf2_data, synth_dir)
+    write_sf2(output_path, sf2_data)
+    print(f"Wrote {output_path}")
+    return output_path
+
+
+if __name__ == "__main__":
+    main()
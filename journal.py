@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import session
+
+JOURNAL_FILE = "session.jsonl"
+SCRATCH_DIR = ".session"
+
+
+def audio_hash(audio):
+    return hashlib.sha256(memoryview(np.ascontiguousarray(audio, dtype='<f4')).cast('B')).hexdigest()
+
+
+class SessionJournal:
+    """
+    Append-only record of a recording session for one synth, so a crash or Ctrl-C doesn't lose
+    finished work.
+
+    Every finished take is saved (trimmed, not normalized yet) to a scratch wav and then a line
+    with its peak, trim indices and hash is appended to the journal.  Both are fsynced before the
+    next note is recorded.  When a preset has been normalized and written, that goes in the
+    journal too and its scratch takes are removed.  On restart the journal is read back, so
+    finished presets are skipped and the takes of an unfinished one are reloaded, including the
+    peaks its normalization needs.  A torn last line (crash while writing) is ignored.
+
+    :param directory: The synth's recordings directory, e.g. 'recordings/Casio Casiotone MT-70'.
+    :param fs: Sample rate of the takes.
+    """
+    def __init__(self, directory, fs):
+        self.directory = directory
+        self.fs = fs
+        self.path = os.path.join(directory, JOURNAL_FILE)
+        self.scratch_dir = os.path.join(directory, SCRATCH_DIR)
+        self.calibration = None
+        self.takes = {}
+        self.done = set()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # Half written when we crashed
+            event = entry['event']
+            if event == 'calibration':
+                self.calibration = entry['thresholds']
+            elif event == 'take':
+                self.takes.setdefault(entry['preset'], {})[entry['note']] = entry
+                self.done.discard(entry['preset'])
+            elif event == 'preset_done':
+                self.done.add(entry['preset'])
+                self.takes.pop(entry['preset'], None)
+
+    def append(self, entry):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            # default= turns numpy scalars into plain Python numbers
+            f.write(json.dumps(entry, default=lambda v: v.item()) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self):
+        """Forget everything and start the synth from scratch."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        self.calibration = None
+        self.takes = {}
+        self.done = set()
+
+    def record_calibration(self, thresholds):
+        self.calibration = list(thresholds)
+        self.append({'event': 'calibration', 'thresholds': self.calibration})
+
+    def record_take(self, preset_name, note, file_path, audio, peak, trim_start, trim_end, streamed_loop=None,
+                    unity_note=60):
+        """
+        Save a trimmed take to scratch and journal it.
+
+        :param audio: The trimmed take, before normalization.
+        :param peak: The peak it will be normalized against.
+        :param streamed_loop: (loop_start, loop_end, score) found while recording, or None.
+        """
+        take_dir = os.path.join(self.scratch_dir, preset_name)
+        os.makedirs(take_dir, exist_ok=True)
+        take_path = os.path.join(take_dir, os.path.basename(file_path))
+        session.write_wav(take_path, self.fs, audio, unity_note=unity_note)
+        with open(take_path, "rb") as f:
+            os.fsync(f.fileno())
+        entry = {'event': 'take', 'preset': preset_name, 'note': note, 'file_path': file_path,
+                 'take_path': take_path, 'peak': peak, 'trim_start': trim_start, 'trim_end': trim_end,
+                 'length': len(audio), 'sha256': audio_hash(audio), 'streamed_loop': streamed_loop}
+        self.append(entry)
+        self.takes.setdefault(preset_name, {})[note] = entry
+        self.done.discard(preset_name)
+
+    def record_preset_done(self, preset_name):
+        self.append({'event': 'preset_done', 'preset': preset_name})
+        self.done.add(preset_name)
+        self.takes.pop(preset_name, None)
+        shutil.rmtree(os.path.join(self.scratch_dir, preset_name), ignore_errors=True)
+
+    def restore(self, preset_name, preset_takes, streamed_loops):
+        """
+        Put the journaled takes of an unfinished preset back into preset_takes (a
+        session.PresetSession) and streamed_loops.  Takes whose scratch file is missing or
+        doesn't match its hash are left out, so they get recorded again.
+
+        :return: The notes that don't need recording again.
+        """
+        restored = set()
+        for note, entry in self.takes.get(preset_name, {}).items():
+            try:
+                wav = session.read_wav(entry['take_path'])
+            except (FileNotFoundError, ValueError):
+                print(f"    Lost the take for {note}, it will be recorded again.")
+                continue
+            if audio_hash(wav.audio) != entry['sha256']:
+                print(f"    The take for {note} is damaged, it will be recorded again.")
+                continue
+            preset_takes.add(entry['file_path'], wav.audio, entry['peak'])
+            if entry['streamed_loop'] is not None:
+                streamed_loops[entry['file_path']] = tuple(entry['streamed_loop'])
+            restored.add(note)
+        return restored
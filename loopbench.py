@@ -0,0 +1,205 @@
+import os, sys
+import argparse
+import subprocess
+import json
+import time
+import tracemalloc
+import numpy as np
+import casioloopdetect
+
+
+##################################################
+#               Synthetic signals                #
+##################################################
+
+def envelope(n_samples, sr, attack_seconds=0.02, decay_per_second=0.3):
+    t = np.arange(n_samples) / sr
+    return np.minimum(t / attack_seconds, 1.0) * np.exp(-t * decay_per_second)
+
+def pulse_wave(period, n_samples, duty=0.5):
+    """Pulse wave with an exactly `period` sample period (period may be fractional)."""
+    phase = (np.arange(n_samples) / period) % 1.0
+    return np.where(phase < duty, 1.0, -1.0)
+
+def make_signal(kind, frequency, sr, seconds, noise=0.0, seed=0):
+    """
+    Generate a Casio-like test note.
+
+    :param kind: 'square', 'pulse' (25% duty) or 'chorus' (two square waves detuned so that
+                 they line up again every 50 periods).
+    :return: (audio as float32, true loop period in samples)
+    """
+    n_samples = int(sr * seconds)
+    period = sr / frequency
+    if kind == 'square':
+        audio = pulse_wave(period, n_samples)
+    elif kind == 'pulse':
+        audio = pulse_wave(period, n_samples, duty=0.25)
+    elif kind == 'chorus':
+        beats = 50
+        audio = 0.5 * (pulse_wave(period, n_samples) + pulse_wave(period * beats / (beats + 1), n_samples))
+        period = period * beats
+    else:
+        raise ValueError(f"Unknown signal kind: {kind}")
+
+    audio = 0.8 * audio * envelope(n_samples, sr)
+    if noise:
+        audio += np.random.default_rng(seed).normal(0, noise, n_samples)
+    return audio.astype(np.float32), period
+
+def make_suite(quick=False):
+    """List of (name, kind, note, sr, seconds, noise)."""
+    suite = []
+    notes = ['C2', 'C4'] if quick else ['C1', 'C2', 'C3', 'C4', 'C5']
+    for sr in ([22050] if quick else [22050, 44100]):
+        for seconds in ([1.5] if quick else [1.5, 4.0]):
+            for note in notes:
+                for kind, noise in [('square', 0.0), ('pulse', 0.01), ('chorus', 0.005)]:
+                    suite.append((f"{kind}-{note}-{sr}-{seconds}s", kind, note, sr, seconds, noise))
+    return suite
+
+
+##################################################
+#                   Detectors                    #
+##################################################
+
+FRACTION = 0.2
+
+def run_new(audio, sr, note):
+    return casioloopdetect.find_seamless_loop_new(audio, sr)[:3]
+
+def run_recommented(audio, sr, note):
+    return casioloopdetect.find_seamless_loop_recommented(audio, sr, FRACTION)
+
+def run_candidates(audio, sr, note):
+    candidates = casioloopdetect.find_loop_candidates(audio, sr, FRACTION, top_k=1)
+    return candidates[0] if candidates else (None, None, None)
+
+def run_pitched(audio, sr, note):
+    return casioloopdetect.find_seamless_loop_pitched(audio, sr, note, FRACTION)
+
+DETECTORS = {
+    'old': lambda audio, sr, note: casioloopdetect.find_seamless_loop(audio, sr, FRACTION, method='old'),
+    'new': run_new,
+    'recommented': run_recommented,
+    'fast-l1': lambda audio, sr, note: casioloopdetect.find_seamless_loop(audio, sr, FRACTION, metric='l1'),
+    'fast-l2': lambda audio, sr, note: casioloopdetect.find_seamless_loop(audio, sr, FRACTION, metric='l2'),
+    'multires': lambda audio, sr, note: casioloopdetect.find_seamless_loop(audio, sr, FRACTION, method='multires'),
+    'candidates': run_candidates,
+    'pitched': run_pitched,
+}
+
+# 'old' is the per-sample loop the fast detectors replace, so it always runs as the baseline
+# (about 2s on a 4s note).  The other two Python loops are as slow and only run when asked for.
+SLOW_DETECTORS = ['new', 'recommented']
+
+
+##################################################
+#                   Benchmark                    #
+##################################################
+
+def loop_error(loop_start, loop_end, period):
+    """Distance in samples from the loop length to the nearest whole number of periods."""
+    if loop_start is None or loop_end is None:
+        return float('inf')
+    periods = (loop_end - loop_start) / period
+    return abs(periods - round(periods)) * period
+
+def run_benchmark(detector_names, suite):
+    results = []
+    for name, kind, note, sr, seconds, noise in suite:
+        audio, period = make_signal(kind, casioloopdetect.note_to_frequency(note), sr, seconds, noise)
+        for detector_name in detector_names:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            loop_start, loop_end, score = DETECTORS[detector_name](audio, sr, note)
+            elapsed = time.perf_counter() - t0
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            result = {
+                'signal': name,
+                'detector': detector_name,
+                'seconds': elapsed,
+                'samples_per_second': len(audio) / elapsed,
+                'peak_memory_mb': peak_memory / 2**20,
+                'error_samples': loop_error(loop_start, loop_end, period),
+            }
+            results.append(result)
+            print(f"{name:24} {detector_name:12} {elapsed:8.3f}s {result['samples_per_second']:12.0f} samples/s "
+                  f"{result['peak_memory_mb']:8.1f}MB  error {result['error_samples']:.2f} samples")
+    return results
+
+def summarize(results):
+    print()
+    print(f"{'detector':12} {'total s':>9} {'median err':>11} {'max err':>9} {'peak MB':>8}")
+    for detector_name in dict.fromkeys(r['detector'] for r in results):
+        rows = [r for r in results if r['detector'] == detector_name]
+        errors = [r['error_samples'] for r in rows]
+        print(f"{detector_name:12} {sum(r['seconds'] for r in rows):9.3f} {np.median(errors):11.2f} "
+              f"{max(errors):9.2f} {max(r['peak_memory_mb'] for r in rows):8.1f}")
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against a previously saved run."""
+    previous = {(r['signal'], r['detector']): r for r in baseline}
+    regressions = []
+    for r in results:
+        old = previous.get((r['signal'], r['detector']))
+        if old is None:
+            continue
+        # Ignore jitter on runs that only take a few milliseconds
+        if r['seconds'] > old['seconds'] * tolerance and r['seconds'] - old['seconds'] > 0.01:
+            regressions.append(f"{r['signal']} {r['detector']}: {old['seconds']:.3f}s -> {r['seconds']:.3f}s")
+        if r['error_samples'] > old['error_samples'] + 1:
+            regressions.append(f"{r['signal']} {r['detector']}: error {old['error_samples']:.2f} -> "
+                               f"{r['error_samples']:.2f} samples")
+    return regressions
+
+STARTUP_BUDGET_MS = 300  # casio2soundfont.py --help, heavy imports have to stay out of the way
+
+def startup_time(args=("--help",), runs=5):
+    """Best of `runs` wall clock times, in ms, for running casio2soundfont.py with args."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "casio2soundfont.py")
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, script, *args], check=True, stdout=subprocess.DEVNULL)
+        times.append((time.perf_counter() - t0) * 1000)
+    return min(times)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the loop detectors on synthetic notes.")
+    parser.add_argument("--detectors", nargs="+", choices=list(DETECTORS),
+                        default=[d for d in DETECTORS if d not in SLOW_DETECTORS])
+    parser.add_argument("--quick", action="store_true", help="a handful of short signals only")
+    parser.add_argument("--save", help="write the results to this json file")
+    parser.add_argument("--compare", help="fail if slower or less accurate than this saved json file")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="allowed slowdown factor for --compare")
+    parser.add_argument("--startup", action="store_true",
+                        help=f"only check that the command line starts within {STARTUP_BUDGET_MS}ms")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        ms = startup_time()
+        print(f"casio2soundfont.py --help: {ms:.0f}ms (budget {STARTUP_BUDGET_MS}ms)")
+        if ms > STARTUP_BUDGET_MS:
+            sys.exit(1)
+        return
+
+    results = run_benchmark(args.detectors, make_suite(args.quick))
+    summarize(results)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import os
+import hashlib
+import json
+import tempfile
+import numpy as np
+import casioloopdetect
+
+CACHE_DIR = ".loopcache"
+
+
+class LoopCache:
+    """
+    On-disk cache of loop detection results, one small json file per result.
+
+    Results are keyed by a hash of the audio samples, the detector name, its version (see
+    casioloopdetect.DETECTOR_VERSIONS) and its parameters, so a file only gets re-detected when
+    its audio, the settings or the detector change.  When the files take
+    up more than max_bytes the least recently used ones are removed.  That check lists the whole
+    directory, so it only runs on about one put in every evict_every.
+
+    Several processes can share a cache (see batchloops.py): each result is written to its own
+    temporary file and renamed into place, and files removed by another process are skipped.
+
+    :param directory: Where to keep the cache.
+    :param max_bytes: Upper limit on the size of the cached results on disk.
+    :param evict_every: Check the size on about one put in this many.
+    """
+    def __init__(self, directory=CACHE_DIR, max_bytes=64 * 2**20, evict_every=64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evict_every = evict_every
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, audio, sr, detector, params):
+        audio = np.ascontiguousarray(audio)
+        h = hashlib.sha256()
+        version = casioloopdetect.DETECTOR_VERSIONS.get(detector, 0)
+        h.update(f"{audio.dtype.str}:{sr}:{detector}:{version}:".encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        h.update(memoryview(audio).cast('B'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if not isinstance(result, list):
+            return None  # Written by an older version
+        try:
+            os.utime(path)  # Mark as recently used
+        except FileNotFoundError:
+            pass  # Evicted by another process since
+        return tuple(result)
+
+    def put(self, key, result):
+        """Store a detector's result tuple, whatever its length."""
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "w") as f:
+                # default= turns numpy scalars into plain Python numbers
+                json.dump(list(result), f, default=lambda v: v.item())
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        # Keys are hashes, so this picks about one put in evict_every whichever process makes it
+        if int(key[:8], 16) % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for e in os.scandir(self.directory):
+            if not e.name.endswith(".json"):
+                continue
+            try:
+                stat = e.stat()
+            except FileNotFoundError:
+                continue  # Removed by another process
+            entries.append((stat.st_mtime, stat.st_size, e.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for e in os.scandir(self.directory):
+            if e.name.endswith(".json"):
+                try:
+                    os.remove(e.path)
+                except FileNotFoundError:
+                    pass
+
+
+def cached(cache, detector, audio, sr, params, detect):
+    """
+    Look up a loop result, or run `detect()` and store what it returns.  With cache=None
+    the cache is bypassed.
+    """
+    if cache is None:
+        return detect()
+    key = cache.key(audio, sr, detector, params)
+    result = cache.get(key)
+    if result is None:
+        result = detect()
+        cache.put(key, result)
+    return result
+
+
+def find_seamless_loop(audio, sr, fraction_of_expected_loop, min_loop_length_frac=0.05, cache=None, **kwargs):
+    """
+    casioloopdetect.find_seamless_loop, going through `cache` (a LoopCache, or None for no caching).
+    """
+    kwargs.setdefault('method', 'fast')
+    params = dict(kwargs, fraction_of_expected_loop=fraction_of_expected_loop,
+                  min_loop_length_frac=min_loop_length_frac)
+    return cached(cache, kwargs['method'], audio, sr, params,
+                  lambda: casioloopdetect.find_seamless_loop(audio, sr, fraction_of_expected_loop,
+                                                             min_loop_length_frac, **kwargs))
+
+
+def find_seamless_loop_pitched(audio, sr, note, fraction_of_expected_loop=0.2, min_loop_length_frac=0.05,
+                               cache=None, **kwargs):
+    """
+    casioloopdetect.find_seamless_loop_pitched, going through `cache` (a LoopCache, or None for no caching).
+    """
+    params = dict(kwargs, note=note, fraction_of_expected_loop=fraction_of_expected_loop,
+                  min_loop_length_frac=min_loop_length_frac)
+    return cached(cache, 'pitched', audio, sr, params,
+                  lambda: casioloopdetect.find_seamless_loop_pitched(audio, sr, note, fraction_of_expected_loop,
+                                                                     min_loop_length_frac, **kwargs))
@@ -0,0 +1,184 @@
+import os, glob
+import json
+import sqlite3
+import time
+from collections import namedtuple
+import casioloopdetect
+
+DB_FILE = "loops.sqlite"  # Next to the synth directories, e.g. recordings/loops.sqlite
+
+Loop = namedtuple('Loop', ['synth', 'preset', 'note', 'file_path', 'loop_start', 'loop_end', 'score', 'quality',
+                           'detector', 'params', 'updated'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loops (
+    synth TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    note TEXT NOT NULL,
+    file_path TEXT,
+    loop_start INTEGER,
+    loop_end INTEGER,
+    score REAL,
+    quality TEXT,
+    detector TEXT,
+    params TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (synth, preset, note)
+)
+"""
+
+UPSERT = """
+INSERT INTO loops VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (synth, preset, note) DO UPDATE SET
+    file_path = excluded.file_path, loop_start = excluded.loop_start, loop_end = excluded.loop_end,
+    score = excluded.score, quality = excluded.quality, detector = excluded.detector,
+    params = excluded.params, updated = excluded.updated
+WHERE excluded.updated {} loops.updated
+"""
+
+
+def db_path(synth_dir):
+    """'recordings/Casio Casiotone MT-70' -> 'recordings/loops.sqlite'"""
+    return os.path.join(os.path.dirname(os.path.normpath(synth_dir)), DB_FILE)
+
+
+def split_path(file_path):
+    """
+    'recordings/Casio Casiotone MT-70/flute/flute-C1.wav' -> ('Casio Casiotone MT-70', 'flute', 'C1')
+    """
+    preset_dir = os.path.dirname(os.path.normpath(file_path))
+    return (os.path.basename(os.path.dirname(preset_dir)), os.path.basename(preset_dir),
+            casioloopdetect.note_from_filename(file_path))
+
+
+def read_loop_file(loop_file_path, quality=None):
+    """
+    Lines of a selected_loops.txt (path,start,end,score,quality) or bad_loops.txt
+    (path,start,end,score, pass quality='bad'), in file order.  None loop points stay None.
+
+    :return: List of (file_path, loop_start, loop_end, score, quality).
+    """
+    def number(text, kind):
+        return None if text == 'None' else kind(text)
+
+    lines = []
+    with open(loop_file_path) as f:
+        for line in f:
+            # The path can have commas in it, the rest can't
+            fields = 4 if quality is None else 3
+            parts = line.strip().rsplit(',', fields)
+            if len(parts) != fields + 1:
+                continue
+            line_quality = quality if quality is not None else parts[4]
+            lines.append((parts[0], number(parts[1], int), number(parts[2], int), number(parts[3], float),
+                          line_quality))
+    return lines
+
+
+class LoopDB:
+    """
+    Loop points, scores and good/bad labels for every recording, in one SQLite file.
+
+    There's one row per synth/preset/note.  Putting a loop for a note that already has one
+    replaces it, unless the one stored is newer, so re-running loop detection never piles up
+    duplicates like appending to selected_loops.txt does.  bank() gets a whole synth with one query.
+
+        with LoopDB(loopdb.db_path(synth_dir)) as db:
+            db.put('Casio Casiotone MT-70', 'flute', 'C1', 53264, 62703, 0.035, 'good')
+            loops = db.bank('Casio Casiotone MT-70')
+
+    :param path: Database file, created if it isn't there.
+    """
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(SCHEMA)
+
+    def row(self, synth, preset, note, loop_start, loop_end, score, quality, file_path=None, detector=None,
+            params=None, updated=None):
+        return (synth, preset, note, file_path,
+                None if loop_start is None else int(loop_start),
+                None if loop_end is None else int(loop_end),
+                None if score is None else float(score), quality, detector,
+                None if params is None else json.dumps(params, sort_keys=True, default=str),
+                time.time() if updated is None else updated)
+
+    def put(self, synth, preset, note, loop_start, loop_end, score, quality, file_path=None, detector=None,
+            params=None, updated=None):
+        """Add or replace the loop of one note.  params (a dict) is stored as json."""
+        row = self.row(synth, preset, note, loop_start, loop_end, score, quality, file_path, detector, params, updated)
+        with self.connection:
+            self.connection.execute(UPSERT.format(">="), row)
+
+    def put_many(self, loops, replace_same_age=True):
+        """
+        put() a list of dicts with the same keys as its arguments, in one transaction.
+
+        :param replace_same_age: Replace a stored loop that is exactly as old as the new one.
+        """
+        statement = UPSERT.format(">=" if replace_same_age else ">")
+        with self.connection:
+            self.connection.executemany(statement, [self.row(**loop) for loop in loops])
+
+    def put_file(self, file_path, loop_start, loop_end, score, quality, detector=None, params=None):
+        """put() for a recordings/<synth>/<preset>/<preset>-<note>.wav."""
+        synth, preset, note = split_path(file_path)
+        self.put(synth, preset, note, loop_start, loop_end, score, quality, file_path, detector, params)
+
+    def bank(self, synth):
+        """Every loop of a synth, as a dict of (preset, note) -> Loop."""
+        rows = self.connection.execute("SELECT * FROM loops WHERE synth = ?", (synth,))
+        loops = {}
+        for row in rows:
+            loop = Loop(*row)
+            if loop.params is not None:
+                loop = loop._replace(params=json.loads(loop.params))
+            loops[loop.preset, loop.note] = loop
+        return loops
+
+    def import_text(self, synth_dir):
+        """
+        Load the selected_loops.txt and bad_loops.txt files of every preset under synth_dir.
+        Lines are timestamped with their file's modification time, and a later line for the
+        same note wins.  Only loops newer than the database's are taken, so importing again
+        changes nothing and what's been put since (with its detector and params) is kept.
+
+        :return: Number of notes found in the files.
+        """
+        loops = {}
+        # bad_loops.txt first, selected_loops.txt has the same loops and the final word
+        for file_name, quality in (("bad_loops.txt", 'bad'), ("selected_loops.txt", None)):
+            for loop_file_path in sorted(glob.glob(os.path.join(glob.escape(synth_dir), "*", file_name))):
+                updated = os.path.getmtime(loop_file_path)
+                synth, preset = split_path(loop_file_path)[:2]
+                for file_path, loop_start, loop_end, score, line_quality in read_loop_file(loop_file_path, quality):
+                    note = casioloopdetect.note_from_filename(file_path)
+                    loops[synth, preset, note] = {'synth': synth, 'preset': preset, 'note': note,
+                                                  'file_path': file_path, 'loop_start': loop_start,
+                                                  'loop_end': loop_end, 'score': score, 'quality': line_quality,
+                                                  'updated': updated}
+        self.put_many(list(loops.values()), replace_same_age=False)
+        return len(loops)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def bank_loops(synth_dir):
+    """
+    All the loops of the synth in synth_dir, from the database next to it.  The synth's text
+    files are imported first, so loops found before there was a database (or by an older
+    version) are included.
+
+    :return: dict of (preset, note) -> Loop
+    """
+    synth = os.path.basename(os.path.normpath(synth_dir))
+    with LoopDB(db_path(synth_dir)) as db:
+        db.import_text(synth_dir)
+        return db.bank(synth)
@@ -1,29 +1,50 @@
 import os, glob, random, sys
 import itertools
 import numpy as np
-import sounddevice as sd
-import librosa
-import scipy.io.wavfile
 import wave
 import time
-import yaml
+from concurrent.futures import ThreadPoolExecutor
+import audiosource
+import calibration
+import journal
+import capture
 import casioloopdetect
+import loopcache
+import loopdb
+import session
+import trimming
 
-print(sd.query_devices())
-
-config_file = "casio_MT-70.yaml"
-config_file = "casio_MT-11.yaml"
+#CONFIG_FILE       = "casio_MT-70.yaml"
+CONFIG_FILE        = "casio_MT-11.yaml"
 
 #DEVICE_NUMBER     = 4
 SAMPLE_RATE        = 44100
 SILENCE_DURATION   = 2.0
 MAX_RECORD_SECONDS = 10
+PRE_ROLL_SECONDS   = 0.1   # Audio kept from before the start threshold was crossed, so the attack isn't clipped.
 START_THRESHOLD    = 0.01
 STOP_THRESHOLD     = 0.005
 WAIT_TIMEOUT       = 20
 TARGET_PEAK_DB     = -1 # dB
 TARGET_PEAK        = 10 ** (TARGET_PEAK_DB / 20)
 PLAY_LOOPS         = False # If you trust the loop detection, make this False and it'll be much faster.
+PITCHED_LOOPS      = False # Only try loop lengths that are whole periods of the note being recorded.
+LOOP_CACHE         = True  # Reuse loop results for audio that hasn't changed.  False re-detects everything.
+STREAM_LOOPS       = True  # Look for loops while each note is recording, so they're ready when it stops.
+REPLAY_DIR         = None  # e.g. "takes/Casio Casiotone MT-70": replay raw takes (<preset>/<preset>-<note>.wav)
+                           # through the whole pipeline, faster than real time and without a sound card.
+INTERACTIVE        = REPLAY_DIR is None  # main() turns this off when replaying
+CALIBRATION_PROFILES = True  # Save the noise floor and thresholds per device, and reuse them next time.
+VERIFY_SECONDS     = 0.5   # Quick check that a saved profile still matches the noise floor.
+NOISE_BANDS        = 16    # Also measure the noise floor in this many frequency bands (None to skip).
+CONTINUOUS_TAKES   = False # Record each preset as one take, playing the notes one after another, and split it up.
+SEGMENT_GAP_SECONDS = 0.3  # In a continuous take, at least this much silence between notes...
+TAKE_END_SILENCE   = 4.0   # ...and this much ends the take.
+MIN_NOTE_SECONDS   = 0.05  # Anything shorter is a click, not a note.
+JOURNAL            = True  # Keep a journal in recordings/<synth>/ so an interrupted session can carry on where it stopped.
+SESSION_MEMORY_MB  = 512   # Takes for a preset are kept in RAM up to this, then in scratch files on disk.
+STREAM_LOOP_SETTINGS = {'start_seconds': 1.0, 'window_seconds': 0.5, 'min_loop_seconds': 0.5,
+                        'search_end_fraction': 0.6, 'metric': 'l2'}  # StreamingLoopDetector, see STREAM_LOOPS
 
 def get_white_keys(start, end):
     white_keys = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
@@ -44,82 +65,53 @@ def get_white_keys(start, end):
 
     return notes
 
-def record_silence(duration=5, fs=SAMPLE_RATE):
-    with sd.InputStream(channels=1, samplerate=fs) as stream:
-        print("Recording silence for calibration...")
-        buffer = []
-        for _ in range(int(duration * fs / 1024)):
-            data, _ = stream.read(1024)
-            buffer.extend(data[:, 0])
-    return np.array(buffer[15:])    # [10:] because I get pops sometimes at the very beginning of recording.
-
-
-def trim_silence(audio_data, threshold):
-    # Find the first index where audio exceeds the threshold
-    #start_index = next((i for i, sample in enumerate(audio_data) if abs(sample) > threshold*0.9), None)
-    start_index = next((i for i, sample in enumerate(audio_data) if abs(sample) > threshold*0.8), None)
-    zero_start_index = casioloopdetect.find_zero_crossing(audio_data, start_index, direction='reverse')
-    print(f"start zerocrossing ({start_index} -> {zero_start_index})")
-    print(audio_data[zero_start_index-1:zero_start_index+2])
-
-    # Find the last index where audio exceeds the threshold
-    #end_index = next((i for i, sample in enumerate(reversed(audio_data)) if abs(sample) > threshold*0.333), None)
-    end_index = next((i for i, sample in enumerate(reversed(audio_data)) if abs(sample) > threshold*0.2), None)
-    zero_end_index = casioloopdetect.find_zero_crossing(audio_data, end_index)
-    print(f"end zerocrossing ({end_index} -> {zero_end_index})")
-    print(audio_data[zero_end_index-1:zero_end_index+2])
-
-    if zero_start_index is not None and zero_end_index is not None:
-        trimmed_audio = audio_data[zero_start_index:-zero_end_index]
-    else:
-        trimmed_audio = audio_data
-
-    return trimmed_audio
-
-
-def record_note(fs=SAMPLE_RATE,
-                max_record_seconds=MAX_RECORD_SECONDS,
-                start_threshold=START_THRESHOLD,
-                stop_threshold=STOP_THRESHOLD,
-                silence_duration=SILENCE_DURATION,
-                wait_timeout=WAIT_TIMEOUT):
-
-    def is_silent(data, threshold):
-        return np.max(np.abs(data)) < threshold
-
-    with sd.Stream(channels=1, samplerate=fs) as stream:
-        buffer = []
-        started = False
-        silent_for = 0
-        start_time = time.time()
-
-        while True:
-            data, overflowed = stream.read(int(fs * 0.5))  # Read in chunks
-            if overflowed:
-                print("Overflow! Recording may not be clean.")
-                return None
-
-            if not started and (time.time() - start_time) > wait_timeout:
-                print("No note detected within the timeout period.")
-                return None
-
-            if not started and np.max(np.abs(data)) > start_threshold:
-                started = True
-                note_start_time = time.time()
-
-            if started:
-                buffer.extend(data[:, 0])
-                if is_silent(data, stop_threshold):
-                    silent_for += 1
-                    if silent_for >= int(silence_duration / 0.5):
-                        break
-                else:
-                    silent_for = 0
-
-                if (time.time() - note_start_time) > max_record_seconds:
-                    break
-
-    return np.array(buffer[15:])    # [15:] because I get pops sometimes at the very beginning of recording.
+def ask(prompt, default):
+    """input(), or just the default answer when nobody is at the keyboard (see INTERACTIVE)."""
+    if not INTERACTIVE:
+        print(f"{prompt}{default}")
+        return default
+    return input(prompt)
+
+def trim_silence(audio_data, threshold, onset=None, offset=None):
+    """
+    Trim the silence off both ends of a recording.  onset and offset, if known (see
+    capture.CaptureEngine), seed and bound the search: the sound can't start after the onset or
+    end after the offset.
+
+    :return: (start, end) indices of the sound, see trimming.find_trim_points.
+    """
+    start, end = trimming.find_trim_points(audio_data, threshold*0.8, threshold*0.2, onset=onset, offset=offset)
+    print(f"trimmed to zerocrossings {start} -> {end}")
+    return start, end
+
+
+def record_note(engine, wait_timeout=WAIT_TIMEOUT, on_chunk=None):
+    """
+    Wait for the next note from the CaptureEngine and return it as a capture.CapturedNote.
+    on_chunk, if given, is called with each chunk of the note as it is recorded (starting with
+    the pre-roll).
+    """
+    return usable_note(engine.next_note(wait_timeout, on_chunk=on_chunk))
+
+def usable_note(note):
+    """The note, or None (and say why) if nothing was played or the input overflowed."""
+    if note is None:
+        print("No note detected within the timeout period.")
+        return None
+    if note.overflowed:
+        print("Overflow! Recording may not be clean.")
+        return None
+    return note
+
+def shift_streamed_loop(loop, offset, length, window_size):
+    """
+    Move a StreamingLoopDetector result to the trimmed audio, which starts `offset` samples into
+    what the detector saw.  Returns None if the loop doesn't fit in the trimmed audio.
+    """
+    loop_start, loop_end, score = loop
+    if loop_start is None or loop_start - offset < 0 or loop_end - offset + window_size > length:
+        return None
+    return loop_start - offset, loop_end - offset, score
 
 def amplitude_to_db(amplitude):
     return 20 * np.log10(abs(amplitude))
@@ -128,117 +120,366 @@ def normalize_audio(audio_data, target_peak, current_peak):
     return audio_data * (target_peak / current_peak)
 
 ##################################################
-#         Calculate Noise and Thresholds         #
+#                 Configuration                  #
 ##################################################
 
-print("Finding noise floor...")
-silence_data = record_silence(SILENCE_DURATION, SAMPLE_RATE)
-max_noise_val = np.max(np.abs(silence_data))
-min_noise_val = np.min(np.abs(silence_data))
-mean_noise_val = np.mean(np.abs(silence_data))
-print(f"Silence Test Results: Min: {min_noise_val}, Max: {max_noise_val}, Mean: {mean_noise_val}")
-mean_noise_val = np.mean(silence_data)
-std_dev = np.std(silence_data)
-sigma_3 = mean_noise_val + 3 * std_dev
-print(f"Mean Value: {mean_noise_val}")
-print(f"3 Sigma: {sigma_3}")
-
-# START and STOP thresholds are used for detecting audio.  I.e., when to start and stop recording.
-# The STOP_THRESHOLD is used to calculated the TRIM_THRESHOLD, which is used to trim the audio
-# after the recording has been completed.
-
-# Prompt user to choose the threshold
-print(f"Current START_THRESHOLD: {START_THRESHOLD}")
-suggested_start_threshold = max_noise_val * 10
-use_max_val = input(f"Do you want to use 10 times the Max value from silence test ({suggested_start_threshold}) as the new START_THRESHOLD? (yes/no): ").strip().lower()
-if use_max_val == 'yes':
-    START_THRESHOLD = suggested_start_threshold
-    STOP_THRESHOLD  = START_THRESHOLD/2
-
-TRIM_THRESHOLD = STOP_THRESHOLD + max_noise_val
-
+def load_config(config_file):
+    """
+    :return: (synth_name, presets, notes) from a synth's yaml file.
+    """
+    import yaml
+
+    with open(config_file, 'r') as f:
+        synth_config = yaml.safe_load(f)
+    synth_name = synth_config['synth_name']
+    presets = synth_config['presets']
+    notes_range = synth_config['notes']
+
+    if len(notes_range) == 2:
+        # We grab white key notes between first and last
+        notes = get_white_keys(notes_range[0], notes_range[1])
+        notes = notes[::2] # Every other white key.
+    else:
+        notes = notes_range
+    return synth_name, presets, notes
+
+def make_source(presets, notes, replay_dir=None, session_journal=None, continuous=False):
+    """
+    The sound card, or a ReplaySource with a take for every note that still needs recording.
+    With continuous=True each preset's notes are replayed as one take.
+    """
+    if replay_dir is None:
+        return audiosource.SoundDeviceSource(SAMPLE_RATE)
+    takes = [[os.path.join(replay_dir, preset['name'], f"{preset['name']}-{note}.wav")
+              for note in notes if not is_recorded(session_journal, preset, note)] for preset in presets]
+    if continuous:
+        takes = [audiosource.Sequence(preset_takes) for preset_takes in takes if preset_takes]
+        # Enough silence after each take to end it
+        return audiosource.ReplaySource(takes, SAMPLE_RATE, gap_seconds=TAKE_END_SILENCE + 1)
+    takes = [take for preset_takes in takes for take in preset_takes]
+    return audiosource.ReplaySource(takes, SAMPLE_RATE)
+
+def is_recorded(session_journal, preset, note=None):
+    """
+    True if the journal says the preset is finished, or has a take of note for it.
+    """
+    if session_journal is None:
+        return False
+    return preset['name'] in session_journal.done or note in session_journal.takes.get(preset['name'], {})
 
 ##################################################
-#                 Configuration                  #
+#         Calculate Noise and Thresholds         #
 ##################################################
 
-with open(config_file, 'r') as f:
-    synth_config = yaml.safe_load(f)
-synth_name = synth_config['synth_name']
-presets = synth_config['presets']
-notes_range = synth_config['notes']
-
-if len(notes_range) == 2:
-    # We grab white key notes between first and last
-    notes = get_white_keys(notes_range[0], notes_range[1])
-    notes = notes[::2] # Every other white key.
-else:
-    notes = notes_range
+def calibrate(source, use_profile=True, channels=(0,)):
+    """
+    Measure the noise floor and pick the thresholds for each input channel, or reuse the saved
+    profiles for this device and sample rate if a short capture shows the noise floor hasn't changed.
+
+    :return: A list with (start_threshold, stop_threshold, trim_threshold) for each channel.
+    """
+    keys = [calibration.profile_key(source, channel) for channel in channels]
+    profiles = calibration.load_profiles() if CALIBRATION_PROFILES and use_profile else {}
+    if all(key in profiles for key in keys):
+        print(f"Checking the noise floor against the saved profiles for {', '.join(keys)}...")
+        verify_stats = calibration.measure_noise(source, VERIFY_SECONDS, channels=channels)
+        if all(calibration.verify_profile(profiles[key], stats) for key, stats in zip(keys, verify_stats)):
+            thresholds = []
+            for key in keys:
+                profile = profiles[key]
+                print(f"{key}: using START_THRESHOLD {profile['start_threshold']} and STOP_THRESHOLD {profile['stop_threshold']}")
+                thresholds.append((profile['start_threshold'], profile['stop_threshold'], profile['trim_threshold']))
+            return thresholds
+        for key, stats in zip(keys, verify_stats):
+            print(f"{key}: noise peak {stats.peak}, was {profiles[key]['noise']['peak']}")
+        print("Noise floor has changed, recalibrating.")
+
+    print("Finding noise floor...")
+    print("Recording silence for calibration...")
+    thresholds = []
+    for key, stats in zip(keys, calibration.measure_noise(source, SILENCE_DURATION, NOISE_BANDS, channels=channels)):
+        if len(keys) > 1:
+            print(f"Input {key}")
+        start_threshold = START_THRESHOLD
+        stop_threshold = STOP_THRESHOLD
+        max_noise_val = stats.peak
+        print(f"Silence Test Results: Min: {stats.min_abs}, Max: {max_noise_val}, Mean: {stats.mean_abs}")
+        sigma_3 = stats.mean + 3 * stats.std
+        print(f"Mean Value: {stats.mean}")
+        print(f"3 Sigma: {sigma_3}")
+        if stats.band_floor_db is not None:
+            print(f"Band floor (dB): {' '.join(f'{db:0.0f}' for db in stats.band_floor_db)}")
+
+        # START and STOP thresholds are used for detecting audio.  I.e., when to start and stop recording.
+        # The STOP_THRESHOLD is used to calculated the TRIM_THRESHOLD, which is used to trim the audio
+        # after the recording has been completed.
+
+        # Prompt user to choose the threshold
+        print(f"Current START_THRESHOLD: {start_threshold}")
+        suggested_start_threshold = max_noise_val * 10
+        use_max_val = ask(f"Do you want to use 10 times the Max value from silence test ({suggested_start_threshold}) as the new START_THRESHOLD? (yes/no): ", "no").strip().lower()
+        if use_max_val == 'yes':
+            start_threshold = suggested_start_threshold
+            stop_threshold  = start_threshold/2
+        trim_threshold = stop_threshold + max_noise_val
+
+        if CALIBRATION_PROFILES:
+            calibration.save_profile(key, {'start_threshold': start_threshold, 'stop_threshold': stop_threshold,
+                                           'trim_threshold': trim_threshold, 'noise': stats.to_dict()})
+            print(f"Saved calibration profile for {key}")
+        thresholds.append((start_threshold, stop_threshold, trim_threshold))
+    return thresholds
 
 ##################################################
 #                      Main                      #
 ##################################################
 
-
-print(f"Synth: {synth_name}")
-print()
-for preset in presets:
-    peak_amplitudes = {}
+def record_preset(engine, synth_name, preset, notes, trim_threshold, session_journal=None, continuous=False):
+    """
+    Record every note of a preset, then normalize, find loops and write the wavs.  With a
+    journal.SessionJournal, a finished preset is skipped and notes already recorded in an
+    unfinished one aren't recorded again.  With continuous=True the notes are recorded as one
+    take (see record_continuous).
+    """
+    preset_takes = session.PresetSession(SAMPLE_RATE, SESSION_MEMORY_MB * 2**20)
+    streamed_loops = {}
     print(f"  {preset}")
     preset_name = preset['name']
     do_loop = preset['loop']
-    input("Hit enter when you have the settings ready.")
+    if session_journal is not None and preset_name in session_journal.done:
+        print("    Already done.")
+        return
+    dir_name = f"recordings/{synth_name}/{preset_name}"
+    os.makedirs(dir_name, exist_ok=True)
+    recorded_notes = set()
+    if session_journal is not None:
+        recorded_notes = session_journal.restore(preset_name, preset_takes, streamed_loops)
+        if recorded_notes:
+            print(f"    Carrying on from the journal, already have {', '.join(sorted(recorded_notes))}")
+    ask("Hit enter when you have the settings ready.", "")
     good_recording = False
     while not good_recording:
-        for note in notes:
+        if continuous:
+            to_record = [note for note in notes if note not in recorded_notes]
+            if to_record and not record_continuous(engine, preset_name, dir_name, to_record, trim_threshold,
+                                                   preset_takes, streamed_loops, session_journal):
+                if ask("Record the whole take again? (y/n)", "n").strip().lower() == "y":
+                    continue
+        for note in notes if not continuous else []:
             print(f"    {note}")
-            dir_name = f"recordings/{synth_name}/{preset_name}"
-            os.makedirs(dir_name, exist_ok=True)
-
+            if note in recorded_notes:
+                print("    Already recorded.")
+                continue
             file_name = f"{preset_name}-{note}.wav"
             file_path = os.path.join(dir_name, file_name)
 
             print(f"    Recording {file_name}...")
-            audio_data = record_note()
-
-            if audio_data is not None:
-                peak_amplitude = np.max(np.abs(audio_data))
-                peak_db = amplitude_to_db(peak_amplitude)
-                peak_amplitudes[file_path] = peak_amplitude
-                print(f"Peak Volume Level: {peak_db} dB")
-                trimmed_audio = trim_silence(audio_data, TRIM_THRESHOLD)
-                scipy.io.wavfile.write(file_path, SAMPLE_RATE, trimmed_audio)
-                len_removed_s = (len(audio_data) - len(trimmed_audio)) / SAMPLE_RATE
-                len_original_s = len(audio_data) / SAMPLE_RATE
-                print(f"    trimmed {len_removed_s:0.2f} seconds {len_removed_s / len_original_s:0.2f}%")
-                if (len(trimmed_audio)/SAMPLE_RATE) < 1:
-                    print(f"    WARNING!!!! new audio is only {len(trimmed_audio)/SAMPLE_RATE:0.2f} seconds long")
-                if (trimmed_audio[:30] == audio_data[:30]).all():
-                    print(f"    WARNING!!!! Nothing was trimmed from the beginning of the recording.")
-                print(f"    ...Saved {file_path}")
+            detector = make_detector(do_loop)
+            recorded = record_note(engine, on_chunk=detector.add if detector is not None else None)
+
+            if recorded is not None:
+                take = keep_take(preset_takes, streamed_loops, file_path, recorded, detector, trim_threshold)
+                journal_take(session_journal, preset_name, note, file_path, preset_takes, streamed_loops, *take)
             else:
                 print("Gave up waiting.")
-        answer = input("Good?  Should we normalize and move on? (y/n)").strip().lower()
+        recorded_notes = set()  # Recording it again means all of it
+        answer = ask("Good?  Should we normalize and move on? (y/n)", "y").strip().lower()
+        if answer == "y":
+            good_recording = True
+
+    with preset_takes:
+        written = finish_preset(preset_takes, streamed_loops, do_loop, dir_name)
+    # A preset with no takes stays unfinished, so a resumed session records it
+    if written and session_journal is not None:
+        session_journal.record_preset_done(preset_name)
+    print("...done.")
+
+def journal_take(session_journal, preset_name, note, file_path, preset_takes, streamed_loops, peak, trim_start,
+                 trim_end):
+    if session_journal is None:
+        return
+    session_journal.record_take(preset_name, note, file_path, preset_takes[file_path], peak, trim_start, trim_end,
+                                streamed_loops.get(file_path), casioloopdetect.note_to_midi(note))
+
+def record_continuous(engine, preset_name, dir_name, notes, trim_threshold, preset_takes, streamed_loops,
+                      session_journal=None):
+    """
+    Record `notes` as one take, played in order with a short gap (SEGMENT_GAP_SECONDS) between
+    them, then split the take at the gaps and keep each note like a separately recorded one.
+    Loops are found afterwards rather than while recording.
+
+    :return: True if the take had the right number of notes.
+    """
+    print(f"    Play {', '.join(notes)} one after the other, with a short gap between them...")
+    take = usable_note(engine.next_note(WAIT_TIMEOUT, silence_duration=TAKE_END_SILENCE,
+                                        max_record_seconds=len(notes) * MAX_RECORD_SECONDS))
+    if take is None:
+        print("Gave up waiting.")
+        return False
+
+    segments = trimming.find_segments(take.audio, engine.start_threshold, engine.stop_threshold,
+                                      int(SEGMENT_GAP_SECONDS * SAMPLE_RATE),
+                                      min_length=int(MIN_NOTE_SECONDS * SAMPLE_RATE))
+    print(f"    Found {len(segments)} notes in {len(take.audio) / SAMPLE_RATE:0.1f} seconds")
+    if len(segments) != len(notes):
+        print(f"    WARNING!!!! Expected {len(notes)} notes ({', '.join(notes)}), found {len(segments)}.")
+        return False
+
+    cuts = trimming.cut_points(segments, len(take.audio), int(PRE_ROLL_SECONDS * SAMPLE_RATE))
+    for note, (start, end) in zip(notes, cuts):
+        print(f"    {note}: {start / SAMPLE_RATE:0.2f}s - {end / SAMPLE_RATE:0.2f}s")
+        file_path = os.path.join(dir_name, f"{preset_name}-{note}.wav")
+        piece = capture.CapturedNote(take.audio[start:end], None, None,
+                                     take.start_sample - take.onset + start, take.overflowed)
+        result = keep_take(preset_takes, streamed_loops, file_path, piece, None, trim_threshold)
+        journal_take(session_journal, preset_name, note, file_path, preset_takes, streamed_loops, *result)
+    return True
+
+def make_detector(do_loop):
+    """A StreamingLoopDetector for the next note, or None if loops aren't found while recording."""
+    if do_loop and STREAM_LOOPS and not PITCHED_LOOPS:
+        return casioloopdetect.StreamingLoopDetector(SAMPLE_RATE, max_seconds=MAX_RECORD_SECONDS + PRE_ROLL_SECONDS,
+                                                     **STREAM_LOOP_SETTINGS)
+    return None
+
+def record_presets_together(multi, synth_names, presets, notes, trim_thresholds, pool, session_journals=None):
+    """
+    record_preset for several keyboards at once, one per channel of a capture.MultiCapture, all
+    playing the same notes.  Each channel's takes are trimmed, and later normalized and looped,
+    in its own worker from `pool`.  With a journal.SessionJournal per keyboard, notes every
+    keyboard already has are skipped, and a keyboard whose preset is already done just plays along:
+    its takes aren't kept or written again.
+    """
+    n = len(presets)
+    session_journals = session_journals or [None] * n
+    done = [is_recorded(j, preset, None) for j, preset in zip(session_journals, presets)]
+    if all(done):
+        print(f"  {', '.join(preset['name'] for preset in presets)}: already done.")
+        return
+    preset_takes = [session.PresetSession(SAMPLE_RATE, SESSION_MEMORY_MB * 2**20) for _ in range(n)]
+    streamed_loops = [{} for _ in range(n)]
+    dir_names = []
+    recorded_notes = set(notes)
+    for i, (synth_name, preset) in enumerate(zip(synth_names, presets)):
+        print(f"  {synth_name}: {preset}{'  (already done)' if done[i] else ''}")
+        dir_names.append(f"recordings/{synth_name}/{preset['name']}")
+        os.makedirs(dir_names[-1], exist_ok=True)
+        if done[i]:
+            continue
+        if session_journals[i] is not None:
+            recorded_notes &= session_journals[i].restore(preset['name'], preset_takes[i], streamed_loops[i])
+        else:
+            recorded_notes = set()
+    ask("Hit enter when you have the settings ready on every keyboard.", "")
+    good_recording = False
+    while not good_recording:
+        for note in notes:
+            print(f"    {note}")
+            if note in recorded_notes:
+                print("    Already recorded.")
+                continue
+            file_paths = [os.path.join(dir_name, f"{preset['name']}-{note}.wav")
+                          for dir_name, preset in zip(dir_names, presets)]
+            detectors = [make_detector(preset['loop']) if not done[i] else None for i, preset in enumerate(presets)]
+            recorded = multi.next_notes(WAIT_TIMEOUT, [d.add if d is not None else None for d in detectors])
+
+            jobs = []
+            for i in range(n):
+                if done[i]:
+                    continue
+                print(f"    {file_paths[i]}")
+                if usable_note(recorded[i]) is None:
+                    print("Gave up waiting.")
+                    continue
+                jobs.append((i, pool.submit(keep_take, preset_takes[i], streamed_loops[i], file_paths[i],
+                                            recorded[i], detectors[i], trim_thresholds[i])))
+            for i, job in jobs:
+                journal_take(session_journals[i], presets[i]['name'], note, file_paths[i], preset_takes[i],
+                             streamed_loops[i], *job.result())
+        recorded_notes = set()
+        answer = ask("Good?  Should we normalize and move on? (y/n)", "y").strip().lower()
         if answer == "y":
             good_recording = True
 
-    overall_peak = max(peak_amplitudes.values())
+    jobs = [pool.submit(finish_preset, preset_takes[i], streamed_loops[i], presets[i]['loop'], dir_names[i])
+            if not done[i] else None for i in range(n)]
+    for job, takes, session_journal, preset in zip(jobs, preset_takes, session_journals, presets):
+        written = job.result() if job is not None else False
+        takes.close()
+        if written and session_journal is not None:
+            session_journal.record_preset_done(preset['name'])
+    print("...done.")
 
+def keep_take(preset_takes, streamed_loops, file_path, recorded, detector, trim_threshold):
+    """
+    Trim a recorded note and keep it in preset_takes, along with its streamed loop if there's a detector.
+
+    :return: (peak, trim_start, trim_end)
+    """
+    audio_data = recorded.audio
+    peak_amplitude = np.max(np.abs(audio_data))
+    peak_db = amplitude_to_db(peak_amplitude)
+    print(f"Peak Volume Level: {peak_db} dB")
+    trim_start, trim_end = trim_silence(audio_data, trim_threshold, recorded.onset, recorded.offset)
+    trimmed_audio = preset_takes.add(file_path, audio_data[trim_start:trim_end], peak_amplitude)
+    if detector is not None:
+        streamed_loops[file_path] = shift_streamed_loop(detector.finish(), trim_start,
+                                                        len(trimmed_audio), detector.window_size)
+    len_removed_s = (len(audio_data) - len(trimmed_audio)) / SAMPLE_RATE
+    len_original_s = len(audio_data) / SAMPLE_RATE
+    print(f"    trimmed {len_removed_s:0.2f} seconds {len_removed_s / len_original_s:0.2f}%")
+    if (len(trimmed_audio)/SAMPLE_RATE) < 1:
+        print(f"    WARNING!!!! new audio is only {len(trimmed_audio)/SAMPLE_RATE:0.2f} seconds long")
+    if trim_start == 0:
+        print(f"    WARNING!!!! Nothing was trimmed from the beginning of the recording.")
+    return peak_amplitude, trim_start, trim_end
+
+def finish_preset(preset_takes, streamed_loops, do_loop, dir_name):
+    """
+    Normalize and loop a preset's takes, all in memory, and write each wav once at the end.
+
+    :return: True if there were takes to write, False if nothing was recorded.
+    """
+    if not len(preset_takes):
+        print(f"Nothing was recorded for {dir_name}.")
+        return False
+    overall_peak = preset_takes.overall_peak
     print("Normalizing and loop detection...")
-    for file_path, peak_amplitude in peak_amplitudes.items():
-        print(f"Normalizing {file_path}")
-        fs, audio_data = scipy.io.wavfile.read(file_path)
-        normalized_audio = normalize_audio(audio_data, TARGET_PEAK, overall_peak)
-        # Overwrite the file with normalized audio
-        scipy.io.wavfile.write(file_path, fs, normalized_audio)
+    preset_takes.normalize(TARGET_PEAK)
+    cache = loopcache.LoopCache() if LOOP_CACHE else None
+    selected_loops = []
+    bad_loops = []
+    loop_rows = []
+    for file_path in preset_takes:
+        audio = preset_takes[file_path]
+        sr = SAMPLE_RATE
+        unity_note = casioloopdetect.note_to_midi(casioloopdetect.note_from_filename(file_path))
 
         if not do_loop:
             print("Preset doesn't require loop finding.  Skipping loop finding.")
+            preset_takes.write(file_path, unity_note=unity_note)
+            print(f"    ...Saved {file_path}")
             continue
 
-        audio, sr = librosa.load(file_path, sr=None)
         fraction_of_expected_loop = 0.2
-        loop_start, loop_end, score = casioloopdetect.find_seamless_loop(audio, sr, fraction_of_expected_loop)
+        if streamed_loops.get(file_path) is not None:
+            # Found while recording.  Normalizing scales the audio, so scale the score with it.
+            loop_start, loop_end, score = streamed_loops[file_path]
+            score *= TARGET_PEAK / overall_peak
+            detector = 'streaming'
+            params = STREAM_LOOP_SETTINGS
+        elif PITCHED_LOOPS:
+            detector = 'pitched'
+            params = {'fraction_of_expected_loop': fraction_of_expected_loop}
+
+            note = casioloopdetect.note_from_filename(file_path)
+            loop_start, loop_end, score = loopcache.find_seamless_loop_pitched(audio, sr, note,
+                                                                               fraction_of_expected_loop, cache=cache)
+        else:
+            detector = 'fast'
+            params = {'fraction_of_expected_loop': fraction_of_expected_loop, 'metric': 'l1'}
+            loop_start, loop_end, score = loopcache.find_seamless_loop(audio, sr, fraction_of_expected_loop,
+                                                                       cache=cache)
 
         good_loop = True
         if PLAY_LOOPS:
@@ -255,24 +496,155 @@ for preset in presets:
                     ANSWER = True
                     good_loop = True
 
-        # Save bad loop info
         if not good_loop:
-            with open(os.path.join(dir_name, "bad_loops.txt"), "a") as badloopf:
-                badloopf.write(f"{file_path},{loop_start},{loop_end},{score}\n")
-            with open(os.path.join(dir_name, "selected_loops.txt"), "a") as goodloopf:
-                goodloopf.write(f"{file_path},{loop_start},{loop_end},{score},bad\n")
-            continue
-
-        # Save good loop info
-        if loop_start is not None and loop_end is not None:
+            # Save bad loop info
+            bad_loops.append(f"{file_path},{loop_start},{loop_end},{score}\n")
+            selected_loops.append(f"{file_path},{loop_start},{loop_end},{score},bad\n")
+            preset_takes.write(file_path, unity_note=unity_note)
+        elif loop_start is not None and loop_end is not None:
+            # Save good loop info
             print(f"Best loop from {loop_start} to {loop_end}. Score: {score}")
-            with open(os.path.join(dir_name, "selected_loops.txt"), "a") as goodloopf:
-                goodloopf.write(f"{file_path},{loop_start},{loop_end},{score},good\n")
-            continue
-
-        # Save no loop found info
-        print("No suitable loop found.")
+            selected_loops.append(f"{file_path},{loop_start},{loop_end},{score},good\n")
+            preset_takes.write(file_path, (loop_start, loop_end), unity_note)
+        else:
+            # Save no loop found info
+            print("No suitable loop found.")
+            selected_loops.append(f"{file_path},{loop_start},{loop_end},{score},bad\n")
+            preset_takes.write(file_path, unity_note=unity_note)
+        print(f"    ...Saved {file_path}")
+        quality = "good" if good_loop and loop_start is not None and loop_end is not None else "bad"
+        synth, preset, note = loopdb.split_path(file_path)
+        loop_rows.append({'synth': synth, 'preset': preset, 'note': note, 'file_path': file_path,
+                          'loop_start': loop_start, 'loop_end': loop_end, 'score': score, 'quality': quality,
+                          'detector': detector, 'params': params})
+
+    if bad_loops:
+        with open(os.path.join(dir_name, "bad_loops.txt"), "a") as badloopf:
+            badloopf.writelines(bad_loops)
+    if selected_loops:
         with open(os.path.join(dir_name, "selected_loops.txt"), "a") as goodloopf:
-            goodloopf.write(f"{file_path},{loop_start},{loop_end},{score},bad\n")
-
-    print("...done.")
+            goodloopf.writelines(selected_loops)
+    if loop_rows:
+        # The text files are kept for reading, the database is what sf2build and import_loops use
+        with loopdb.LoopDB(loopdb.db_path(os.path.dirname(os.path.normpath(dir_name)))) as db:
+            db.put_many(loop_rows)
+    return True
+
+def open_journal(synth_name, restart=False):
+    if not JOURNAL:
+        return None
+    session_journal = journal.SessionJournal(f"recordings/{synth_name}", SAMPLE_RATE)
+    if restart:
+        session_journal.clear()
+    elif session_journal.done or session_journal.takes:
+        print(f"Found an unfinished session in {session_journal.path}, carrying on with it.")
+    return session_journal
+
+def main(config_file=CONFIG_FILE, replay_dir=REPLAY_DIR, recalibrate=False, restart=False, continuous=CONTINUOUS_TAKES):
+    """
+    Record, trim, normalize and loop every preset in config_file.
+
+    :param replay_dir: Replay takes from this directory instead of recording from the sound card.
+    :param recalibrate: Measure the noise floor again even if there's a saved profile for the device.
+    :param restart: Ignore the journal of an earlier session and record everything again.
+    :param continuous: Record each preset as one take and split it into notes.
+    """
+    global INTERACTIVE
+    if replay_dir is not None:
+        INTERACTIVE = False
+
+    synth_name, presets, notes = load_config(config_file)
+    session_journal = open_journal(synth_name, restart)
+    if session_journal is not None and all(preset['name'] in session_journal.done for preset in presets):
+        print(f"Every preset of {synth_name} is already done (see {session_journal.path}).  Use --restart to record it again.")
+        return
+    source = make_source(presets, notes, replay_dir, session_journal, continuous)
+    print(source.describe())
+    if session_journal is not None and session_journal.calibration is not None and not recalibrate:
+        # Same thresholds as the rest of the session
+        start_threshold, stop_threshold, trim_threshold = session_journal.calibration[0]
+        print(f"Using START_THRESHOLD {start_threshold} and STOP_THRESHOLD {stop_threshold} from the journal")
+    else:
+        start_threshold, stop_threshold, trim_threshold = calibrate(source, use_profile=not recalibrate)[0]
+        if session_journal is not None:
+            session_journal.record_calibration([(start_threshold, stop_threshold, trim_threshold)])
+
+    # One input stream for the whole session.  Notes are cut out of it on the audio thread.
+    with capture.CaptureEngine(source, start_threshold, stop_threshold, SILENCE_DURATION,
+                               MAX_RECORD_SECONDS, PRE_ROLL_SECONDS) as engine:
+        print(f"Synth: {synth_name}")
+        print()
+        for preset in presets:
+            record_preset(engine, synth_name, preset, notes, trim_threshold, session_journal, continuous)
+
+
+def main_multi(config_files, replay_dir=None, recalibrate=False, input_channels=None, restart=False):
+    """
+    Record several keyboards at once, each on its own input of one interface.  They all play the
+    same notes (from the first config) and their presets are recorded side by side, first with
+    first, second with second and so on.
+
+    :param config_files: A synth yaml file for each keyboard.
+    :param replay_dir: Replay takes from replay_dir/<synth_name>/<preset>/<preset>-<note>.wav instead.
+    :param recalibrate: Measure the noise floor again even if there are saved profiles.
+    :param input_channels: The input (counting from 0) each keyboard is on, defaults to 0, 1, 2...
+    :param restart: Ignore the journals of an earlier session and record everything again.
+    """
+    global INTERACTIVE
+    if replay_dir is not None:
+        INTERACTIVE = False
+
+    configs = [load_config(config_file) for config_file in config_files]
+    synth_names = [synth_name for synth_name, _, _ in configs]
+    notes = configs[0][2]
+    for synth_name, _, other_notes in configs[1:]:
+        if other_notes != notes:
+            print(f"WARNING: {synth_name} has different notes, recording {notes} on every keyboard.")
+    input_channels = list(input_channels or range(len(configs)))
+    n_channels = max(input_channels) + 1
+    preset_groups = list(zip(*[presets for _, presets, _ in configs]))
+    for synth_name, presets, _ in configs:
+        if len(presets) > len(preset_groups):
+            print(f"WARNING: only the first {len(preset_groups)} presets of {synth_name} will be recorded.")
+    session_journals = [open_journal(synth_name, restart) for synth_name in synth_names]
+
+    if replay_dir is None:
+        source = audiosource.SoundDeviceSource(SAMPLE_RATE, channels=n_channels)
+    else:
+        takes = []
+        for group in preset_groups:
+            for note in notes:
+                if all(is_recorded(j, preset, note) for j, preset in zip(session_journals, group)):
+                    continue
+                take = [None] * n_channels
+                for synth_name, preset, channel, j in zip(synth_names, group, input_channels, session_journals):
+                    if not is_recorded(j, preset):
+                        take[channel] = os.path.join(replay_dir, synth_name, preset['name'],
+                                                     f"{preset['name']}-{note}.wav")
+                takes.append(take)
+        source = audiosource.ReplaySource(takes, SAMPLE_RATE, channels=n_channels)
+    print(source.describe())
+    if all(j is not None and j.calibration is not None for j in session_journals) and not recalibrate:
+        # Same thresholds as the rest of the session
+        thresholds = [j.calibration[0] for j in session_journals]
+        print("Using the thresholds from the journals")
+    else:
+        thresholds = calibrate(source, use_profile=not recalibrate, channels=input_channels)
+        for session_journal, channel_thresholds in zip(session_journals, thresholds):
+            if session_journal is not None:
+                session_journal.record_calibration([channel_thresholds])
+
+    engines = [capture.CaptureEngine(source, start_threshold, stop_threshold, SILENCE_DURATION,
+                                     MAX_RECORD_SECONDS, PRE_ROLL_SECONDS, channel=channel)
+               for (start_threshold, stop_threshold, _), channel in zip(thresholds, input_channels)]
+    trim_thresholds = [trim_threshold for _, _, trim_threshold in thresholds]
+    # One stream for every input, and a worker per keyboard for the trimming and loop finding
+    with capture.MultiCapture(source, engines) as multi, ThreadPoolExecutor(len(configs)) as pool:
+        print(f"Synths: {', '.join(synth_names)}")
+        print()
+        for presets in preset_groups:
+            record_presets_together(multi, synth_names, presets, notes, trim_thresholds, pool, session_journals)
+
+
+if __name__ == "__main__":
+    main()
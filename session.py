@@ -0,0 +1,206 @@
+import os
+import shutil
+import struct
+import tempfile
+from collections import namedtuple
+import numpy as np
+
+
+def write_wav(file_path, fs, audio, loop=None, unity_note=60):
+    """
+    Write mono float32 audio as a WAV file in one go, with an optional smpl chunk for the loop
+    so samplers (and the sf2 tools) can pick it up from the file itself.
+
+    :param file_path: Where to write it.
+    :param fs: Sample rate.
+    :param audio: The audio data (numpy array).
+    :param loop: (loop_start, loop_end) with loop_end exclusive like everywhere else here, or None.
+    :param unity_note: MIDI note the sample was recorded at.
+    """
+    audio = np.ascontiguousarray(audio, dtype='<f4')
+    data_size = audio.nbytes
+    # fmt chunk for IEEE float (format 3) with an empty extension, like scipy writes
+    fmt = struct.pack('<HHIIHHH', 3, 1, fs, fs * 4, 4, 32, 0)
+    chunks = [(b'fmt ', fmt), (b'fact', struct.pack('<I', len(audio)))]
+    if loop is not None and loop[0] is not None:
+        loop_start, loop_end = loop
+        smpl = struct.pack('<9I', 0, 0, int(1e9 / fs), unity_note, 0, 0, 0, 1, 0)
+        # The smpl end is the last sample played, not one past it
+        smpl += struct.pack('<6I', 0, 0, int(loop_start), int(loop_end) - 1, 0, 0)
+        chunks.append((b'smpl', smpl))
+
+    header = b''.join(struct.pack('<4sI', chunk_id, len(body)) + body for chunk_id, body in chunks)
+    riff_size = 4 + len(header) + 8 + data_size + (data_size & 1)
+    with open(file_path, 'wb') as f:
+        f.write(struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE'))
+        f.write(header)
+        f.write(struct.pack('<4sI', b'data', data_size))
+        f.write(memoryview(audio).cast('B'))
+        if data_size & 1:
+            f.write(b'\x00')
+
+
+Wav = namedtuple('Wav', ['fs', 'audio', 'loop', 'unity_note'])
+
+
+def read_wav(file_path):
+    """
+    Read a wav written by write_wav (or any 16/32 bit PCM or float wav) as mono float32.
+
+    :return: Wav(fs, audio, loop, unity_note), loop is (loop_start, loop_end) or None and
+             unity_note is None if the file has no smpl chunk.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError(f"{file_path} is not a wav file")
+
+    fmt = audio = loop = unity_note = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, size = struct.unpack_from('<4sI', data, position)
+        body = position + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack_from('<HHIIHH', data, body)
+        elif chunk_id == b'data':
+            audio = (body, min(size, len(data) - body))
+        elif chunk_id == b'smpl':
+            unity_note = struct.unpack_from('<I', data, body + 12)[0]
+            if struct.unpack_from('<I', data, body + 28)[0]:
+                loop_start, loop_end = struct.unpack_from('<II', data, body + 36 + 8)
+                loop = (loop_start, loop_end + 1)
+        position = body + size + (size & 1)
+    if fmt is None or audio is None:
+        raise ValueError(f"{file_path} has no fmt or data chunk")
+
+    format_tag, channels, fs, _, block_align, bits = fmt
+    if format_tag == 0xFFFE:
+        format_tag = struct.unpack_from('<H', data, data.index(b'fmt ') + 8 + 24)[0]
+    dtypes = {(1, 16): '<i2', (1, 32): '<i4', (3, 32): '<f4', (3, 64): '<f8'}
+    if (format_tag, bits) not in dtypes:
+        raise ValueError(f"{file_path}: unsupported wav format {format_tag} with {bits} bits")
+    dtype = np.dtype(dtypes[format_tag, bits])
+    start, size = audio
+    samples = np.frombuffer(data, dtype, size // block_align * channels, start)[::channels]
+    if dtype.kind == 'i':
+        samples = samples / float(np.iinfo(dtype).max)
+    return Wav(fs, samples.astype(np.float32), loop, unity_note)
+
+
+class PresetSession:
+    """
+    Holds the trimmed takes of one preset until they're normalized, looped and written.
+
+    Takes are kept in memory while they fit in memory_budget bytes, after that each one goes to
+    its own memory-mapped scratch file, so a long preset doesn't need all of it in RAM.  Recording
+    a note again replaces its take.
+
+    :param fs: Sample rate.
+    :param memory_budget: Bytes of takes to keep in RAM before spilling to scratch files.
+    :param scratch_dir: Where the scratch files go (a temporary directory by default).
+    """
+    def __init__(self, fs, memory_budget=256 * 2**20, scratch_dir=None):
+        self.fs = fs
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self.own_scratch_dir = False
+        self.scratch_files = 0
+        self.takes = {}
+        self.peaks = {}
+        self.in_memory = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.takes)
+
+    def __iter__(self):
+        return iter(self.takes)
+
+    def __getitem__(self, file_path):
+        return self.takes[file_path]
+
+    def add(self, file_path, audio, peak=None):
+        """
+        Keep a copy of `audio` as the take for file_path.
+
+        :param peak: Peak level to normalize against, defaults to the peak of audio.
+        """
+        self.discard(file_path)
+        if peak is None:
+            peak = float(np.max(np.abs(audio))) if len(audio) else 0.0
+        size = len(audio) * 4
+        if self.in_memory + size <= self.memory_budget:
+            take = np.array(audio, dtype=np.float32)
+            self.in_memory += size
+        else:
+            if self.scratch_dir is None:
+                self.scratch_dir = tempfile.mkdtemp(prefix="casio2soundfont-")
+                self.own_scratch_dir = True
+            scratch_path = os.path.join(self.scratch_dir, f"take-{self.scratch_files}.f32")
+            self.scratch_files += 1
+            take = np.memmap(scratch_path, dtype=np.float32, mode='w+', shape=(max(len(audio), 1),))[:len(audio)]
+            take[:] = audio
+        self.takes[file_path] = take
+        self.peaks[file_path] = peak
+        return take
+
+    def discard(self, file_path):
+        take = self.takes.pop(file_path, None)
+        self.peaks.pop(file_path, None)
+        if take is None:
+            return
+        if isinstance(take, np.memmap):
+            scratch_path = take.filename
+            del take
+            os.remove(scratch_path)
+        else:
+            self.in_memory -= take.nbytes
+
+    @property
+    def overall_peak(self):
+        return max(self.peaks.values())
+
+    def normalize(self, target_peak):
+        """Scale every take in place so the loudest one peaks at target_peak.  Returns the gain."""
+        gain = target_peak / self.overall_peak
+        for take in self.takes.values():
+            take *= np.float32(gain)
+        return gain
+
+    def write(self, file_path, loop=None, unity_note=60):
+        write_wav(file_path, self.fs, self.takes[file_path], loop, unity_note)
+
+    def close(self):
+        for file_path in list(self.takes):
+            self.discard(file_path)
+        if self.own_scratch_dir:
+            shutil.rmtree(self.scratch_dir, ignore_errors=True)
+            self.scratch_dir = None
+            self.own_scratch_dir = False
+
+
+def normalize_preset(preset_dir, target_peak):
+    """
+    Normalize the wavs of a preset that is already on disk against their overall peak, keeping
+    their loops.  Returns the gain.
+    """
+    import glob
+
+    with PresetSession(None) as takes:
+        wavs = {}
+        for file_path in sorted(glob.glob(os.path.join(preset_dir, "*.wav"))):
+            wav = read_wav(file_path)
+            takes.add(file_path, wav.audio)
+            wavs[file_path] = wav._replace(audio=None)
+        if not wavs:
+            return None
+        gain = takes.normalize(target_peak)
+        for file_path, wav in wavs.items():
+            write_wav(file_path, wav.fs, takes[file_path], wav.loop,
+                      60 if wav.unity_note is None else wav.unity_note)
+    return gain
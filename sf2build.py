@@ -0,0 +1,224 @@
+import os, glob
+import struct
+import time
+import numpy as np
+import casioloopdetect
+import loopdb
+import session
+import sf2file
+
+# SoundFont 2.01 generator numbers
+GEN_INSTRUMENT = 41
+GEN_KEY_RANGE = 43
+GEN_SAMPLE_ID = 53
+GEN_SAMPLE_MODES = 54
+
+# sampleModes: 0 plays straight through, 1 loops for as long as the sound lasts, 3 loops while the
+# key is held then plays the rest of the sample on release.
+LOOP_MODES = {'none': 0, 'continuous': 1, 'release': 3}
+
+SAMPLE_PADDING = 46  # Zero samples the spec wants after every sample
+MONO_SAMPLE = 1
+
+
+def key_ranges(midi_notes):
+    """
+    Split the keyboard between sorted recorded notes, half way between neighbours.  The lowest
+    note gets everything below it and the highest everything above it.
+
+    :return: List of (low_key, high_key), one per note.
+    """
+    ranges = []
+    for i, note in enumerate(midi_notes):
+        low = 0 if i == 0 else (midi_notes[i - 1] + note) // 2 + 1
+        high = 127 if i == len(midi_notes) - 1 else (note + midi_notes[i + 1]) // 2
+        ranges.append((low, high))
+    return ranges
+
+
+def to_pcm16(audio):
+    """float audio (-1..1) to 16 bit PCM in one go."""
+    return np.clip(np.round(audio * 32767.0), -32768, 32767).astype('<i2')
+
+
+def fixed_name(name):
+    """Name for the 20 byte fields of the pdta chunk, which need at least one zero at the end."""
+    return name.encode('ascii', errors='replace')[:19]
+
+
+def chunk(chunk_id, data):
+    if len(data) & 1:
+        data += b'\x00'
+    return struct.pack('<4sI', chunk_id, len(data)) + data
+
+
+def list_chunk(list_type, chunks):
+    body = b''.join(chunks)
+    return struct.pack('<4sI4s', b'LIST', len(body) + 4, list_type) + body
+
+
+def info_string(text):
+    data = text.encode('ascii', errors='replace') + b'\x00'
+    return data + b'\x00' * (len(data) & 1)
+
+
+def load_preset(preset_dir, preset_name, loops):
+    """
+    The recorded samples of one preset, lowest note first.  A sample's loop comes from loops
+    if it's there (and good), otherwise from the smpl chunk of its wav.
+
+    :param loops: loopdb.bank_loops of the synth.
+    :return: List of dicts with name, key (MIDI note), fs, pcm (int16) and loop ((start, end) or None).
+    """
+    samples = []
+    for file_path in glob.glob(os.path.join(preset_dir, f"{glob.escape(preset_name)}-*.wav")):
+        file_name = os.path.basename(file_path)
+        note = casioloopdetect.note_from_filename(file_path)
+        try:
+            key = casioloopdetect.note_to_midi(note)
+        except (KeyError, ValueError):
+            continue  # Not <preset>-<note>.wav
+        wav = session.read_wav(file_path)
+        loop = None
+        if (preset_name, note) in loops:
+            found = loops[preset_name, note]
+            if found.quality == 'good' and found.loop_start is not None and found.loop_end is not None:
+                loop = (found.loop_start, found.loop_end)
+        elif wav.loop is not None:
+            loop = wav.loop
+        if loop is not None and not 0 <= loop[0] < loop[1] <= len(wav.audio):
+            print(f"    Ignoring loop {loop} of {file_name}, it doesn't fit in {len(wav.audio)} samples")
+            loop = None
+        samples.append({'name': file_name[:-4], 'key': key, 'fs': wav.fs, 'pcm': to_pcm16(wav.audio),
+                        'loop': loop})
+    samples.sort(key=lambda sample: sample['key'])
+    return samples
+
+
+def build_sf2(bank_name, instruments):
+    """
+    Build a whole SoundFont bank.  Every instrument becomes a preset of its own (numbered in
+    order, bank 0) with one instrument zone per sample.
+
+    :param bank_name: Shown by players as the bank's name.
+    :param instruments: List of (name, loop_mode, samples) with samples from load_preset and
+                        loop_mode one of LOOP_MODES.
+    :return: The .sf2 file contents as bytes.
+    """
+    # sdta: every sample's PCM back to back, each followed by SAMPLE_PADDING zeros
+    all_samples = [sample for _, _, samples in instruments for sample in samples]
+    lengths = np.array([len(sample['pcm']) for sample in all_samples], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(lengths + SAMPLE_PADDING)[:-1]]).astype(np.int64)
+    smpl = np.zeros(int(np.sum(lengths + SAMPLE_PADDING)), dtype='<i2')
+    for sample, start in zip(all_samples, starts):
+        smpl[start:start + len(sample['pcm'])] = sample['pcm']
+
+    # One record per sample plus the terminal EOS, which np.zeros already made
+    n_samples = len(all_samples)
+    shdr = np.zeros(n_samples + 1, dtype=sf2file.SHDR)
+    shdr['name'] = [fixed_name(sample['name']) for sample in all_samples] + [b'EOS']
+    shdr['start'][:-1] = starts
+    shdr['end'][:-1] = starts + lengths
+    shdr['sampleRate'][:-1] = [sample['fs'] for sample in all_samples]
+    shdr['originalPitch'][:-1] = [sample['key'] for sample in all_samples]
+    shdr['type'][:-1] = MONO_SAMPLE
+    looped = [i for i, sample in enumerate(all_samples) if sample['loop'] is not None]
+    shdr['startLoop'][:-1] = starts
+    shdr['endLoop'][:-1] = starts
+    sf2file.set_relative_loops(shdr, looped, [all_samples[i]['loop'][0] for i in looped],
+                               [all_samples[i]['loop'][1] for i in looped])
+
+    # Instruments with a zone per sample (keyRange, sampleModes, sampleID), then a preset per
+    # instrument with one zone pointing at it.  Bags and generators end in a terminal record too.
+    n_instruments = len(instruments)
+    inst = np.zeros(n_instruments + 1, dtype=sf2file.INST)
+    inst['name'] = [fixed_name(name) for name, _, _ in instruments] + [b'EOI']
+    inst['bag'] = np.concatenate([[0], np.cumsum([len(samples) for _, _, samples in instruments])])
+    ibag = np.zeros(n_samples + 1, dtype=sf2file.BAG)
+    ibag['gen'] = np.arange(n_samples + 1) * 3
+    igen = np.zeros(n_samples * 3 + 1, dtype=sf2file.GEN)
+    # keyRange has to come first and sampleID last
+    igen['oper'][:-1] = np.tile([GEN_KEY_RANGE, GEN_SAMPLE_MODES, GEN_SAMPLE_ID], n_samples)
+    ranges = np.array([key_range for _, _, samples in instruments
+                       for key_range in key_ranges([sample['key'] for sample in samples])], dtype=np.uint8)
+    igen['lo'][0:-1:3] = ranges[:, 0]
+    igen['hi'][0:-1:3] = ranges[:, 1]
+    igen['amount'][1:-1:3] = [LOOP_MODES[loop_mode] if sample['loop'] is not None else 0
+                              for _, loop_mode, samples in instruments for sample in samples]
+    igen['word'][2:-1:3] = np.arange(n_samples)
+
+    phdr = np.zeros(n_instruments + 1, dtype=sf2file.PHDR)
+    phdr['name'] = inst['name'][:-1].tolist() + [b'EOP']
+    phdr['preset'][:-1] = np.arange(n_instruments)
+    phdr['bag'] = np.arange(n_instruments + 1)
+    pbag = np.zeros(n_instruments + 1, dtype=sf2file.BAG)
+    pbag['gen'] = np.arange(n_instruments + 1)
+    pgen = np.zeros(n_instruments + 1, dtype=sf2file.GEN)
+    pgen['oper'][:-1] = GEN_INSTRUMENT
+    pgen['word'][:-1] = np.arange(n_instruments)
+    no_modulators = np.zeros(1, dtype=sf2file.MOD)
+
+    info = list_chunk(b'INFO', [chunk(b'ifil', struct.pack('<HH', 2, 1)),
+                                chunk(b'isng', info_string('EMU8000')),
+                                chunk(b'INAM', info_string(bank_name)),
+                                chunk(b'ISFT', info_string('casio2soundfont'))])
+    sdta = list_chunk(b'sdta', [chunk(b'smpl', memoryview(smpl).cast('B').tobytes())])
+    tables = [(b'phdr', phdr), (b'pbag', pbag), (b'pmod', no_modulators), (b'pgen', pgen),
+              (b'inst', inst), (b'ibag', ibag), (b'imod', no_modulators), (b'igen', igen), (b'shdr', shdr)]
+    pdta = list_chunk(b'pdta', [chunk(chunk_id, sf2file.encode_table(table)) for chunk_id, table in tables])
+    body = b'sfbk' + info + sdta + pdta
+    return struct.pack('<4sI', b'RIFF', len(body)) + body
+
+
+def preset_loop_mode(preset):
+    """
+    The loop mode of a preset from the synth yaml: its `loop_mode` if it has one, otherwise
+    'continuous' for presets with loop: True.
+    """
+    if 'loop_mode' in preset:
+        if preset['loop_mode'] not in LOOP_MODES:
+            raise ValueError(f"{preset['name']}: loop_mode should be one of {', '.join(LOOP_MODES)}")
+        return preset['loop_mode']
+    return 'continuous' if preset.get('loop') else 'none'
+
+
+def build_synth(config_file, output_path=None, recordings_dir="recordings"):
+    """
+    Build <synth_name>.sf2 from a synth yaml, its recordings/<synth>/<preset>/*.wav and their
+    loops (see loopdb.bank_loops).  Returns the path written.
+    """
+    import yaml
+
+    t0 = time.perf_counter()
+    with open(config_file) as f:
+        synth_config = yaml.safe_load(f)
+    synth_name = synth_config['synth_name']
+    if output_path is None:
+        output_path = f"{synth_name}.sf2"
+
+    synth_dir = os.path.join(recordings_dir, synth_name)
+    loops = loopdb.bank_loops(synth_dir) if os.path.isdir(synth_dir) else {}
+    instruments = []
+    for preset in synth_config['presets']:
+        preset_dir = os.path.join(synth_dir, preset['name'])
+        samples = load_preset(preset_dir, preset['name'], loops)
+        if not samples:
+            print(f"  {preset['name']}: no recordings in {preset_dir}, skipping")
+            continue
+        loop_mode = preset_loop_mode(preset)
+        looped = sum(sample['loop'] is not None for sample in samples)
+        print(f"  {preset['name']}: {len(samples)} samples, {looped} looped ({loop_mode})")
+        instruments.append((preset['name'], loop_mode, samples))
+    if not instruments:
+        raise ValueError(f"No recordings found for {synth_name} in {recordings_dir}")
+
+    data = build_sf2(synth_name, instruments)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, output_path)
+    sf2file.fsync_dir(output_path)
+    print(f"Wrote {output_path} ({len(data) / 2**20:0.1f}MB) in {time.perf_counter() - t0:0.2f} seconds")
+    return output_path
@@ -0,0 +1,246 @@
+import os
+import mmap
+import struct
+import zlib
+import numpy as np
+
+# The pdta tables as numpy structured dtypes, laid out byte for byte like the file (no padding),
+# so a whole chunk decodes with one np.frombuffer and encodes with one tobytes().
+PHDR = np.dtype([('name', 'S20'), ('preset', '<u2'), ('bank', '<u2'), ('bag', '<u2'),
+                 ('library', '<u4'), ('genre', '<u4'), ('morphology', '<u4')])
+BAG = np.dtype([('gen', '<u2'), ('mod', '<u2')])
+MOD = np.dtype([('src', '<u2'), ('dest', '<u2'), ('amount', '<i2'), ('amount_src', '<u2'), ('transform', '<u2')])
+# A generator's amount is a signed or unsigned word, or a lo/hi byte pair for key and velocity ranges
+GEN = np.dtype({'names': ['oper', 'amount', 'word', 'lo', 'hi'],
+                'formats': ['<u2', '<i2', '<u2', 'u1', 'u1'],
+                'offsets': [0, 2, 2, 2, 3], 'itemsize': 4})
+INST = np.dtype([('name', 'S20'), ('bag', '<u2')])
+# Same field names as import_loops.parse_shdr_chunk
+SHDR = np.dtype([('name', 'S20'), ('start', '<u4'), ('end', '<u4'), ('startLoop', '<u4'), ('endLoop', '<u4'),
+                 ('sampleRate', '<u4'), ('originalPitch', 'u1'), ('pitchCorrection', 'i1'), ('link', '<u2'),
+                 ('type', '<u2')])
+
+HYDRA = {b'phdr': PHDR, b'pbag': BAG, b'pmod': MOD, b'pgen': GEN,
+         b'inst': INST, b'ibag': BAG, b'imod': MOD, b'igen': GEN, b'shdr': SHDR}
+
+
+def decode_table(chunk_id, data):
+    """
+    A pdta sub-chunk (bytes, memoryview, ...) as a structured array onto the same memory, terminal
+    record included.  Copy it before changing it if data is read-only.
+    """
+    dtype = HYDRA[chunk_id]
+    if len(data) % dtype.itemsize:
+        raise ValueError(f"{chunk_id.decode()} is {len(data)} bytes, not a whole number of "
+                         f"{dtype.itemsize} byte records")
+    return np.frombuffer(data, dtype=dtype)
+
+
+def encode_table(table):
+    return table.tobytes()
+
+
+def decode_name(name):
+    """A 20 byte name field as a str.  It ends at the first zero, whatever comes after it is junk."""
+    return bytes(name).split(b'\x00', 1)[0].decode('utf-8', errors='ignore')
+
+
+def set_relative_loops(shdr, index, loop_starts, loop_ends):
+    """
+    Set the loops of the samples at index from points relative to each sample's start (as in
+    selected_loops.txt), all in one go.
+    """
+    index = np.asarray(index, dtype=np.intp)
+    starts = shdr['start'][index]
+    shdr['startLoop'][index] = starts + np.asarray(loop_starts, dtype=np.uint32)
+    shdr['endLoop'][index] = starts + np.asarray(loop_ends, dtype=np.uint32)
+
+
+class SF2Reader:
+    """
+    Memory mapped SoundFont file.
+
+    Opening it only walks the RIFF headers to build an index of where every chunk is, nothing
+    is read.  Chunk payloads come back as memoryviews or numpy arrays straight onto the mapping,
+    so looking at (or patching) the pdta tables of a bank with hundreds of MB of samples only
+    touches the pages that are actually used.
+
+        with SF2Reader("CasioMT70.sf2") as sf2:
+            shdr = sf2.table(b'shdr')
+            audio = sf2.smpl  # int16, no copy
+
+    Views handed out stay valid until close().  Delete them first or close() can't unmap the
+    file (it's then left to the garbage collector).
+
+    :param file_path: .sf2 file.
+    :param writable: Map it read/write, so changes to the views go into the file.
+    """
+    def __init__(self, file_path, writable=False):
+        self.file_path = file_path
+        self.file = open(file_path, "r+b" if writable else "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{file_path} is empty")
+        self.writable = writable
+        # (list type or None, chunk id, payload offset, payload size), in file order
+        self.layout = []
+        self.index = {}
+        try:
+            self.build_index()
+        except ValueError:
+            self.close()
+            raise
+
+    def build_index(self):
+        if len(self.map) < 12:
+            raise ValueError(f"{self.file_path} is not a valid RIFF file")
+        riff_id, riff_size, self.format = struct.unpack_from('<4sI4s', self.map, 0)
+        if riff_id != b'RIFF':
+            raise ValueError(f"{self.file_path} is not a valid RIFF file")
+        riff_end = min(8 + riff_size, len(self.map))
+        offset = 12
+        while offset + 8 <= riff_end:
+            chunk_id, size = struct.unpack_from('<4sI', self.map, offset)
+            if offset + 8 + size > len(self.map):
+                raise ValueError(f"{self.file_path}: {chunk_id} chunk runs past the end of the file")
+            if chunk_id == b'LIST':
+                list_type = bytes(self.map[offset + 8:offset + 12]).decode('ascii', errors='replace')
+                sub_offset, list_end = offset + 12, offset + 8 + size
+                while sub_offset + 8 <= list_end:
+                    sub_id, sub_size = struct.unpack_from('<4sI', self.map, sub_offset)
+                    if sub_offset + 8 + sub_size > list_end:
+                        raise ValueError(f"{self.file_path}: {sub_id} chunk runs past the end of LIST {list_type}")
+                    self.add(list_type, sub_id, sub_offset + 8, sub_size)
+                    sub_offset += 8 + sub_size + (sub_size & 1)
+            else:
+                self.add(None, chunk_id, offset + 8, size)
+            offset += 8 + size + (size & 1)
+
+    def add(self, list_type, chunk_id, offset, size):
+        self.layout.append((list_type, chunk_id, offset, size))
+        # The first one wins if a chunk id turns up twice
+        self.index.setdefault(chunk_id, (offset, size))
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.index
+
+    def offset(self, chunk_id):
+        """(payload offset, payload size) of a chunk in the file."""
+        try:
+            return self.index[chunk_id]
+        except KeyError:
+            raise KeyError(f"{self.file_path} has no {chunk_id.decode(errors='replace')} chunk") from None
+
+    def chunk(self, chunk_id):
+        """Payload of a chunk as a memoryview onto the file."""
+        offset, size = self.offset(chunk_id)
+        return memoryview(self.map)[offset:offset + size]
+
+    def array(self, chunk_id, dtype):
+        """Payload of a chunk as a numpy array of dtype, no copy.  Read-only unless writable."""
+        dtype = np.dtype(dtype)
+        offset, size = self.offset(chunk_id)
+        return np.frombuffer(self.map, dtype=dtype, count=size // dtype.itemsize, offset=offset)
+
+    def table(self, chunk_id):
+        """A pdta table (phdr, pbag, ... shdr) as a structured array onto the file, see HYDRA."""
+        return decode_table(chunk_id, self.chunk(chunk_id))
+
+    @property
+    def smpl(self):
+        """The 16 bit sample data of every sample, back to back."""
+        return self.array(b'smpl', '<i2')
+
+    def close(self):
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # Someone still has a view, the mapping goes when they're done with it
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+PATCH_SUFFIX = ".patch"
+PATCH_MAGIC = b'SF2PATCH'
+
+
+def write_patch(file_path, offset, data):
+    with open(file_path, "r+b") as f:
+        f.seek(offset)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def fsync_dir(file_path):
+    """fsync the directory file_path is in, so a file created, renamed or removed there stays that way."""
+    fd = os.open(os.path.dirname(os.path.abspath(file_path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def recover_patch(file_path):
+    """
+    Finish a patch_chunk that was interrupted.  A complete journal is written again (the file
+    may have been half patched), an incomplete one is thrown away (the file wasn't touched yet).
+
+    :return: True if a patch was replayed.
+    """
+    journal_path = file_path + PATCH_SUFFIX
+    try:
+        with open(journal_path, "rb") as f:
+            journal = f.read()
+    except FileNotFoundError:
+        return False
+    header_size = struct.calcsize('<8sQI')
+    replayed = False
+    if len(journal) >= header_size + 4:
+        magic, offset, size = struct.unpack_from('<8sQI', journal)
+        body = journal[:header_size + size]
+        if (magic == PATCH_MAGIC and len(journal) == header_size + size + 4
+                and struct.unpack_from('<I', journal, header_size + size)[0] == zlib.crc32(body)):
+            write_patch(file_path, offset, journal[header_size:header_size + size])
+            replayed = True
+    os.remove(journal_path)
+    fsync_dir(journal_path)
+    return replayed
+
+
+def patch_chunk(file_path, chunk_id, data):
+    """
+    Overwrite one chunk's payload in place, e.g. a new shdr with different loop points.  Nothing
+    else in the file is read or written, so it takes the same time whatever the size of the bank.
+
+    The new bytes go to <file_path>.patch and are fsynced before the file is touched, so if we
+    crash half way through, recover_patch (called here next time) finishes the job.
+
+    :param data: New payload, the same size as the old one.
+    """
+    recover_patch(file_path)
+    with SF2Reader(file_path) as sf2:
+        offset, size = sf2.offset(chunk_id)
+    if len(data) != size:
+        raise ValueError(f"New {chunk_id.decode(errors='replace')} is {len(data)} bytes, the one in "
+                         f"{file_path} is {size}.  It can only be patched in place if they're the same size.")
+    journal_path = file_path + PATCH_SUFFIX
+    body = struct.pack('<8sQI', PATCH_MAGIC, offset, size) + bytes(data)
+    with open(journal_path, "wb") as f:
+        f.write(body + struct.pack('<I', zlib.crc32(body)))
+        f.flush()
+        os.fsync(f.fileno())
+    # The journal's directory entry has to be on disk too, or a crash could lose the journal
+    fsync_dir(journal_path)
+    write_patch(file_path, offset, data)
+    os.remove(journal_path)
+    fsync_dir(journal_path)
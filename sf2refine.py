@@ -0,0 +1,146 @@
+import os, sys
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import casioloopdetect
+import sf2file
+
+WINDOW_SIZE = 1024  # Samples compared around the loop seam
+SEARCH_RADIUS = 32  # How far either way the loop start and end can move
+MIN_GAIN = 0.05  # A loop is only moved if that makes its seam score at least this much (relatively) better
+
+
+def seam_scores(audio, loop_start, loop_end, window_size=WINDOW_SIZE, radius=SEARCH_RADIUS):
+    """
+    RMS difference around the seam for every loop start within radius of loop_start and every
+    loop end within radius of loop_end, all at once.  The window is centred on the seam: what
+    plays either side of the loop end is compared with what's either side of the loop start,
+    which is what you hear when the loop jumps back.
+
+    Each score is divided by the RMS level of the two windows, so a seam doesn't look better
+    just because the loop moved somewhere quieter.
+
+    :return: (starts, ends, scores) with scores[i, j] for the loop starts[i] -> ends[j].
+    """
+    half = window_size // 2
+    starts = np.arange(max(half, loop_start - radius), loop_start + radius + 1)
+    first = max(half, loop_end - radius)
+    last = min(loop_end + radius, len(audio) - window_size + half)
+    if len(starts) == 0 or last < first:
+        return starts, np.empty(0, dtype=int), np.empty((len(starts), 0))
+    ends = np.arange(first, last + 1)
+    scores = casioloopdetect.multi_start_scores(audio, starts - half, window_size, first - half, last - half)
+    energy = np.concatenate(([0.0], np.cumsum(np.asarray(audio, dtype=np.float64) ** 2)))
+    start_energy = energy[starts + window_size - half] - energy[starts - half]
+    end_energy = energy[ends + window_size - half] - energy[ends - half]
+    level = np.sqrt((start_energy[:, None] + end_energy[None, :]) / (2 * window_size))
+    # Silence against silence is a perfect seam, not 0 / 0
+    scores = np.where(level > 0, scores / np.maximum(level, np.finfo(np.float64).tiny), 0.0)
+    return starts, ends, scores
+
+
+def refine_sample(sf2_path, index, window_size=WINDOW_SIZE, radius=SEARCH_RADIUS, min_gain=MIN_GAIN):
+    """
+    Worker: re-score one sample's loop on the 16 bit PCM in the bank and find the best loop
+    within radius of it.  The loop stays where it is unless the best one scores at least
+    min_gain (a fraction) better.
+
+    :return: (index, name, loop_start, loop_end, score, new_start, new_end, new_score) with loop
+             points relative to the sample start, or None if the loop can't be scored.
+    """
+    with sf2file.SF2Reader(sf2_path) as sf2:
+        header = sf2.table(b'shdr')[index]
+        start, end = int(header['start']), int(header['end'])
+        audio = sf2.smpl[start:end].astype(np.float64) / 32768
+        name = sf2file.decode_name(header['name'])
+        loop_start, loop_end = int(header['startLoop']) - start, int(header['endLoop']) - start
+        del header
+
+    starts, ends, scores = seam_scores(audio, loop_start, loop_end, window_size, radius)
+    # Keep the loop at least a window long, and the stored loop has to be in the search to compare against
+    scores = np.where(ends[None, :] - starts[:, None] >= window_size, scores, np.inf)
+    if loop_start not in starts or loop_end not in ends or not np.isfinite(scores).any():
+        return None
+    before = float(scores[loop_start - starts[0], loop_end - ends[0]])
+    best_start, best_end = np.unravel_index(np.argmin(scores), scores.shape)
+    after = float(scores[best_start, best_end])
+    if after > before * (1 - min_gain):
+        return index, name, loop_start, loop_end, before, loop_start, loop_end, before
+    return index, name, loop_start, loop_end, before, int(starts[best_start]), int(ends[best_end]), after
+
+
+def looped_samples(shdr):
+    """Indices of the samples in shdr that have a loop (not the terminal EOS)."""
+    has_loop = shdr['endLoop'][:-1] > shdr['startLoop'][:-1]
+    inside = (shdr['startLoop'][:-1] >= shdr['start'][:-1]) & (shdr['endLoop'][:-1] <= shdr['end'][:-1])
+    return np.flatnonzero(has_loop & inside)
+
+
+def refine_bank(sf2_path, window_size=WINDOW_SIZE, radius=SEARCH_RADIUS, workers=None, dry_run=False,
+                min_gain=MIN_GAIN):
+    """
+    Refine every loop in a soundfont against its own sample data, in parallel, print a
+    before/after report and patch the improved loops into the file in place (see
+    sf2file.patch_chunk).  No wavs needed.
+
+    :param dry_run: Only print the report.
+    :param min_gain: Smallest relative improvement of the seam score worth moving a loop for.
+    :return: The report rows, see refine_sample.
+    """
+    t0 = time.perf_counter()
+    sf2file.recover_patch(sf2_path)
+    with sf2file.SF2Reader(sf2_path) as sf2:
+        shdr = sf2.table(b'shdr').copy()
+    indices = looped_samples(shdr)
+    workers = workers or os.cpu_count()
+    print(f"Refining {len(indices)} loops in {sf2_path} using {workers} workers")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(indices) // (workers * 4))
+        results = list(pool.map(refine_sample, [sf2_path] * len(indices), indices.tolist(),
+                                [window_size] * len(indices), [radius] * len(indices),
+                                [min_gain] * len(indices), chunksize=chunksize))
+
+    report = [result for result in results if result is not None]
+    print(f"{'sample':20} {'loop':>17} {'score':>9}   {'refined':>17} {'score':>9}")
+    improved = []
+    for index, name, loop_start, loop_end, before, new_start, new_end, after in report:
+        line = f"{name:20} {loop_start:>8} {loop_end:>8} {before:9.5f}   {new_start:>8} {new_end:>8} {after:9.5f}"
+        if (new_start, new_end) != (loop_start, loop_end):
+            improved.append((index, new_start, new_end))
+            line += f"  {100 * (1 - after / before):0.1f}% better"
+        print(line)
+    skipped = len(indices) - len(report)
+    if skipped:
+        print(f"{skipped} loops were too close to the edge of their sample to score.")
+
+    if improved and not dry_run:
+        sf2file.set_relative_loops(shdr, *zip(*improved))
+        sf2file.patch_chunk(sf2_path, b'shdr', sf2file.encode_table(shdr))
+    action = "would move" if dry_run else "moved"
+    print(f"...{action} {len(improved)} of {len(report)} loops in {time.perf_counter() - t0:0.2f} seconds.")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refine the loops of a soundfont on its own 16 bit samples.")
+    parser.add_argument("soundfont", help=".sf2 file, changed in place")
+    parser.add_argument("--window", type=int, default=WINDOW_SIZE,
+                        help=f"samples compared around the loop seam (default {WINDOW_SIZE})")
+    parser.add_argument("--radius", type=int, default=SEARCH_RADIUS,
+                        help=f"how many samples the loop start and end can move (default {SEARCH_RADIUS})")
+    parser.add_argument("--min-gain", type=float, default=MIN_GAIN,
+                        help=f"only move a loop if that makes its seam score at least this much better "
+                             f"(default {MIN_GAIN}, i.e. {MIN_GAIN:.0%})")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: all cores)")
+    parser.add_argument("--dry-run", action="store_true", help="only print the report, don't change the file")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(args.soundfont):
+        sys.exit(f"No such file: {args.soundfont}")
+    refine_bank(args.soundfont, args.window, args.radius, args.workers, args.dry_run, args.min_gain)
+
+
+if __name__ == "__main__":
+    main()
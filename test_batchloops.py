@@ -0,0 +1,26 @@
+import pytest
+import batchloops
+import casioloopdetect
+import loopbench
+import session
+
+
+@pytest.mark.parametrize("method", batchloops.METHODS)
+@pytest.mark.parametrize("metric", ["l1", "l2"])
+def test_find_loop_runs_every_method(method, metric):
+    sr = 22050
+    audio, _ = loopbench.make_signal('pulse', casioloopdetect.note_to_frequency('C3'), sr, 1.5, noise=0.01)
+    loop_start, loop_end, score = batchloops.find_loop(audio, sr, metric=metric, method=method)
+    assert loop_start is not None and loop_end > loop_start
+
+
+@pytest.mark.parametrize("method", batchloops.METHODS)
+def test_detect_loop_runs_every_method(tmp_path, method):
+    pytest.importorskip("librosa")
+    sr = 22050
+    audio, _ = loopbench.make_signal('pulse', casioloopdetect.note_to_frequency('C3'), sr, 1.5, noise=0.01)
+    file_path = str(tmp_path / "flute-C3.wav")
+    session.write_wav(file_path, sr, audio)
+    result_path, loop_start, loop_end, score, seconds = batchloops.detect_loop(file_path, method=method)
+    assert result_path == file_path
+    assert loop_start is not None and loop_end > loop_start
@@ -0,0 +1,42 @@
+import time
+import numpy as np
+import audiosource
+import capture
+import session
+
+
+def tone(sr, seconds=1.0, frequency=220.0):
+    t = np.arange(int(sr * seconds)) / sr
+    return (0.5 * np.sin(2 * np.pi * frequency * t) * np.exp(-3 * t)).astype(np.float32)
+
+
+def test_multicapture_does_not_wait_for_a_channel_nothing_was_played_on():
+    sr = 22050
+    source = audiosource.ReplaySource([[tone(sr), None], [None, tone(sr)]], sr, channels=2, gap_seconds=1.0)
+    engines = [capture.CaptureEngine(source, 0.01, 0.005, 0.5, 5, channel=channel) for channel in (0, 1)]
+    with capture.MultiCapture(source, engines) as multi:
+        t0 = time.perf_counter()
+        first = multi.next_notes(timeout=20)
+        second = multi.next_notes(timeout=20)
+        elapsed = time.perf_counter() - t0
+
+    assert first[0] is not None and first[1] is None
+    assert second[0] is None and second[1] is not None
+    assert elapsed < 5
+
+
+
+def test_replay_carries_on_after_takes_it_cannot_play(tmp_path):
+    sr = 22050
+    good, wrong_rate = str(tmp_path / "good.wav"), str(tmp_path / "wrong-rate.wav")
+    session.write_wav(good, sr, tone(sr))
+    session.write_wav(wrong_rate, 44100, tone(44100))
+    takes = [str(tmp_path / "missing.wav"), wrong_rate, good]
+    source = audiosource.ReplaySource(takes, sr, gap_seconds=1.0)
+    with capture.CaptureEngine(source, 0.01, 0.005, 0.5, 5) as engine:
+        t0 = time.perf_counter()
+        notes = [engine.next_note(timeout=20) for _ in takes]
+        elapsed = time.perf_counter() - t0
+
+    assert notes[0] is None and notes[1] is None and notes[2] is not None
+    assert elapsed < 5
@@ -0,0 +1,31 @@
+import numpy as np
+import casioloopdetect
+import loopbench
+
+
+def test_streaming_first_scored_end_is_a_minimum_loop_after_the_start():
+    sr = 22050
+    audio, _ = loopbench.make_signal('pulse', casioloopdetect.note_to_frequency('C3'), sr, 4.0, noise=0.01)
+    detector = casioloopdetect.StreamingLoopDetector(sr, max_seconds=5)
+    for i in range(0, len(audio), 512):
+        detector.add(audio[i:i + 512])
+    loop_start, loop_end, score = detector.finish()
+
+    scored = np.flatnonzero(np.isfinite(detector.scores))
+    assert loop_start >= detector.start_search_point
+    assert scored[0] == loop_start + detector.min_loop_length
+    assert loop_end >= loop_start + detector.min_loop_length
+
+
+def test_streaming_matches_the_whole_note_search():
+    sr = 22050
+    audio, _ = loopbench.make_signal('square', casioloopdetect.note_to_frequency('C2'), sr, 3.0)
+    detector = casioloopdetect.StreamingLoopDetector(sr, max_seconds=5)
+    for i in range(0, len(audio), 128):
+        detector.add(audio[i:i + 128])
+    loop_start, loop_end, _ = detector.finish()
+
+    window = audio[loop_start:loop_start + detector.window_size]
+    scores = casioloopdetect.sliding_window_scores(window, audio, loop_start + detector.min_loop_length,
+                                                   int(len(audio) * detector.search_end_fraction), metric='l2')
+    assert loop_end == loop_start + detector.min_loop_length + len(scores) - 1 - np.argmin(scores[::-1])
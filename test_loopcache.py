@@ -0,0 +1,19 @@
+import casioloopdetect
+import loopbench
+import loopcache
+
+
+def test_caches_results_of_any_length(tmp_path):
+    sr = 22050
+    audio, _ = loopbench.make_signal('pulse', casioloopdetect.note_to_frequency('C3'), sr, 1.5, noise=0.01)
+    cache = loopcache.LoopCache(str(tmp_path))
+    first = loopcache.find_seamless_loop(audio, sr, 0.2, method='multires', subsample=True, cache=cache)
+    again = loopcache.find_seamless_loop(audio, sr, 0.2, method='multires', subsample=True, cache=cache)
+    assert len(first) == 4 and again == first
+
+
+def test_key_changes_with_the_detector_version(tmp_path, monkeypatch):
+    cache_key = loopcache.LoopCache(str(tmp_path)).key
+    key = cache_key([0.0, 1.0], 22050, 'fast', {})
+    monkeypatch.setitem(casioloopdetect.DETECTOR_VERSIONS, 'fast', casioloopdetect.DETECTOR_VERSIONS['fast'] + 1)
+    assert cache_key([0.0, 1.0], 22050, 'fast', {}) != key
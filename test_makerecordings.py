@@ -0,0 +1,65 @@
+import numpy as np
+import audiosource
+import capture
+import journal
+import makerecordings
+
+SR = makerecordings.SAMPLE_RATE
+
+
+def tone(seconds=1.5, frequency=220.0):
+    t = np.arange(int(SR * seconds)) / SR
+    return (0.5 * np.sin(2 * np.pi * frequency * t) * np.exp(-2 * t)).astype(np.float32)
+
+
+class Replay(audiosource.ReplaySource):
+    """ReplaySource where a None take is a missing file."""
+    def load(self, take):
+        if take is None:
+            raise FileNotFoundError("missing.wav")
+        return super().load(take)
+
+
+def record(takes, preset, notes, session_journal):
+    source = Replay(takes, SR, gap_seconds=1.0)
+    with capture.CaptureEngine(source, 0.01, 0.005, 0.5, 5) as engine:
+        makerecordings.record_preset(engine, "Test Synth", preset, notes, 0.01, session_journal)
+
+
+def test_resume_records_a_preset_that_had_no_takes(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(makerecordings, "INTERACTIVE", False)
+    preset, notes = {'name': 'flute', 'loop': False}, ['C3', 'G3']
+
+    session_journal = journal.SessionJournal("recordings/Test Synth", SR)
+    record([None, None], preset, notes, session_journal)
+    assert not makerecordings.is_recorded(session_journal, preset)
+
+    # Carry on as if the session had been restarted
+    session_journal = journal.SessionJournal("recordings/Test Synth", SR)
+    assert 'flute' not in session_journal.done
+    record([tone(), tone()], preset, notes, session_journal)
+    assert 'flute' in session_journal.done
+    assert 'flute' in journal.SessionJournal("recordings/Test Synth", SR).done
+    assert (tmp_path / "recordings/Test Synth/flute/flute-C3.wav").exists()
+
+
+def test_recording_together_leaves_a_finished_keyboard_alone(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(makerecordings, "INTERACTIVE", False)
+    synths, notes = ["Synth A", "Synth B"], ['C3', 'G3']
+    presets = [{'name': 'flute', 'loop': False}, {'name': 'organ', 'loop': False}]
+    journals = [journal.SessionJournal(f"recordings/{synth}", SR) for synth in synths]
+    journals[0].record_preset_done('flute')
+
+    source = Replay([[tone(), tone()] for _ in notes], SR, channels=2, gap_seconds=1.0)
+    engines = [capture.CaptureEngine(source, 0.01, 0.005, 0.5, 5, channel=channel) for channel in (0, 1)]
+    with capture.MultiCapture(source, engines) as multi, ThreadPoolExecutor(2) as pool:
+        makerecordings.record_presets_together(multi, synths, presets, notes, [0.01, 0.01], pool, journals)
+
+    assert not (tmp_path / "recordings/Synth A/flute/flute-C3.wav").exists()
+    assert 'flute' not in journal.SessionJournal("recordings/Synth A", SR).takes
+    assert (tmp_path / "recordings/Synth B/organ/organ-C3.wav").exists()
+    assert 'organ' in journal.SessionJournal("recordings/Synth B", SR).done
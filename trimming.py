@@ -0,0 +1,131 @@
+import numpy as np
+import casioloopdetect
+
+
+def block_envelope(audio, block_size=256, kind='peak'):
+    """
+    Envelope of the audio, one value per block of block_size samples.
+
+    :param kind: 'peak' for the largest absolute sample in each block, 'rms' for the RMS level.
+    """
+    n_blocks = -(-len(audio) // block_size)
+    blocks = np.zeros(n_blocks * block_size, dtype=np.float32)
+    blocks[:len(audio)] = audio
+    blocks = blocks.reshape(n_blocks, block_size)
+    if kind == 'peak':
+        return np.max(np.abs(blocks), axis=1)
+    if kind == 'rms':
+        return np.sqrt(np.mean(blocks.astype(np.float64) ** 2, axis=1))
+    raise ValueError(f"Unknown envelope: {kind}")
+
+
+def find_trim_points(audio, start_threshold, stop_threshold, block_size=256, kind='peak', zero_crossings=None,
+                     max_snap=None, onset=None, offset=None):
+    """
+    Find where the sound in a recording starts and stops.
+
+    The sound starts in the first block louder than start_threshold, and is followed back from
+    there to the first sample louder than stop_threshold (hysteresis, so the attack isn't cut).
+    It ends after the last sample louder than stop_threshold.  Both edges are then moved out to
+    the nearest zero crossing, if there is one within max_snap samples.
+
+    :param audio: The audio data (numpy array).
+    :param start_threshold: Level the sound has to reach to count as started.
+    :param stop_threshold: Level below which it counts as silence.
+    :param block_size: Envelope block size in samples.
+    :param kind: 'peak' or 'rms' envelope.
+    :param zero_crossings: Optional casioloopdetect.ZeroCrossingIndex of audio.
+    :param max_snap: How far an edge may move to reach a zero crossing, defaults to block_size.
+                     Stops a run of digital silence (exact zeros) pulling the start way back.
+    :param onset: Sample where the note is known to have started (see capture.CaptureEngine).  The
+                  start is searched for no later than this, and taken from here if nothing before
+                  it is loud enough.
+    :param offset: One past the last sample of the note, if known.  Nothing after it is searched.
+    :return: (start, end) so that audio[start:end] is the sound, or (0, len(audio)) if nothing
+             was loud enough.
+    """
+    if offset is None:
+        offset = len(audio)
+    envelope = block_envelope(audio[:offset], block_size, kind)
+    loud = np.flatnonzero(envelope > start_threshold)
+    if onset is not None:
+        loud = loud[loud <= onset // block_size]
+        if len(loud) == 0:
+            loud = np.array([onset // block_size])  # Seed the search with the capture's onset
+    if len(loud) == 0:
+        return 0, len(audio)
+
+    # Go back from the first loud block to the last block that was quiet
+    quiet = np.flatnonzero(envelope[:loud[0]] <= stop_threshold)
+    first_block = quiet[-1] + 1 if len(quiet) else 0
+    segment = audio[first_block * block_size:(loud[0] + 1) * block_size]
+    if onset is not None:
+        segment = segment[:onset + 1 - first_block * block_size]
+    over = np.abs(segment) > stop_threshold
+    # Without an onset the envelope is over stop_threshold in first_block, so this is always found
+    start = first_block * block_size + int(np.argmax(over)) if over.any() else onset
+
+    over = np.flatnonzero(envelope > stop_threshold)
+    if len(over):
+        last_block = over[-1]
+        segment = audio[last_block * block_size:min((last_block + 1) * block_size, offset)]
+        end = last_block * block_size + int(np.flatnonzero(np.abs(segment) > stop_threshold)[-1]) + 1
+    else:
+        end = offset
+    end = max(end, start + 1)
+
+    if zero_crossings is None:
+        zero_crossings = casioloopdetect.ZeroCrossingIndex(audio)
+    if max_snap is None:
+        max_snap = block_size
+    crossing = zero_crossings.at_or_before(start)
+    if crossing is not None and start - crossing <= max_snap:
+        start = crossing
+    crossing = zero_crossings.at_or_after(end)
+    if crossing is not None and crossing - end <= max_snap:
+        end = crossing
+    return start, min(end, len(audio))
+
+
+def find_segments(audio, start_threshold, stop_threshold, min_gap, block_size=256, kind='peak', min_length=0):
+    """
+    Find the separate notes in one long take.
+
+    A note is a run of blocks louder than stop_threshold that gets louder than start_threshold
+    somewhere.  Runs less than min_gap samples apart count as the same note, so a dip in the
+    middle of a note doesn't split it, and runs shorter than min_length samples are dropped (clicks).
+
+    :param audio: The audio data (numpy array).
+    :param min_gap: Samples of silence needed between two notes.
+    :return: List of (start, end) sample indices, block aligned, in order.
+    """
+    envelope = block_envelope(audio, block_size, kind)
+    active = envelope > stop_threshold
+    if not active.any():
+        return []
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], active.astype(np.int8), [0]])))
+    starts, ends = edges[::2], edges[1::2]
+
+    # Join runs with short gaps between them
+    first = np.concatenate([[True], starts[1:] - ends[:-1] >= -(-min_gap // block_size)])
+    first_index = np.flatnonzero(first)
+    last_index = np.concatenate([first_index[1:] - 1, [len(ends) - 1]])
+    starts, ends = starts[first_index], ends[last_index]
+
+    loudest = np.maximum.reduceat(envelope, starts)
+    keep = (loudest > start_threshold) & ((ends - starts) * block_size >= min_length)
+    return [(int(s) * block_size, min(int(e) * block_size, len(audio))) for s, e in zip(starts[keep], ends[keep])]
+
+
+def cut_points(segments, length, pre_roll=0):
+    """
+    Where to cut a take so each segment from find_segments gets its own piece of audio: half way
+    through the silence between notes, and pre_roll samples before the first one.  The pieces
+    still need trimming.
+    """
+    cuts = []
+    for i, (start, end) in enumerate(segments):
+        cut_start = max(0, start - pre_roll) if i == 0 else (segments[i - 1][1] + start) // 2
+        cut_end = length if i == len(segments) - 1 else (end + segments[i + 1][0]) // 2
+        cuts.append((cut_start, cut_end))
+    return cuts